@@ -1,16 +1,57 @@
 import os
+import sys
+from time import perf_counter
+
+start = perf_counter()
+timings = {}
+
 from PyQt5.QtWidgets import QApplication
 from PyQt5.QtGui import QFontDatabase
+from PyQt5.QtCore import QTimer
+
+from home import Home
+import resources
+
+timings["imports"] = perf_counter()
+
+STYLE_FONTS = ("Regular", "Light", "Medium", "ExtraBold")
+
+
+def add_fonts(names: list) -> None:
+    for name in names:
+        QFontDatabase.addApplicationFont(resources.path("fonts", name))
+
+
+def report() -> None:
+    timings["first event"] = perf_counter()
+    previous = start
+    for stage, moment in timings.items():
+        print(f"{stage:<12} {(moment - previous) * 1000:8.1f} ms")
+        previous = moment
+    print(f"{'total':<12} {(previous - start) * 1000:8.1f} ms")
+
+
+def main() -> None:
+    app = QApplication(sys.argv)
+    timings["application"] = perf_counter()
+
+    fonts = os.listdir(resources.path("fonts"))
+    style_fonts = [f"HelveticaNowDisplay-{weight}.ttf" for weight in STYLE_FONTS]
+    add_fonts(style_fonts)
+    timings["fonts"] = perf_counter()
+
+    home = Home()
+    home.show()
+    timings["home"] = perf_counter()
 
-from home import Home, Paint
+    if "--timing" in sys.argv:
+        QTimer.singleShot(0, report)
 
-app = QApplication([])
+    QTimer.singleShot(0, lambda: add_fonts([font for font in fonts if font not in style_fonts]))
 
-fonts = [os.path.join("static/fonts", font) for font in os.listdir("static/fonts")]
-for font in fonts:
-    QFontDatabase.addApplicationFont(font)
+    app.exec_()
 
-home = Home()
-home.show()
 
-app.exec_()
+# DICOM conversion workers re-import this script under spawn, so the GUI starts only in the main process
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import sys
+import json
+import platform
+import argparse
+import tracemalloc
+from time import perf_counter
+from itertools import product
+
+import numpy as np
+from PyQt5.QtCore import QCoreApplication
+from skimage.filters import gaussian
+from skimage.transform import warp
+
+from frames import FrameStack, ArrayFrames
+from lucas_kanade import LucasKanade, Profiler, _area2cont, _get_main_points, _get_points
+
+WALLS = {"endo": 1.0, "epi": 1.35}
+
+
+class Sequence:
+    """Speckle textured ventricle contracting and relaxing over one cycle"""
+
+    def __init__(self, height: int, width: int, frames: int, amplitude: float = 0.12, seed: int = 0):
+        self.shape = height, width
+        self.frames = frames
+        self.amplitude = amplitude
+        self.center = np.array([width * 0.5, height * 0.55])
+        self.axes = np.array([width * 0.18, height * 0.32])
+
+        rng = np.random.default_rng(seed)
+        speckle = gaussian(rng.random(self.shape), sigma=1.5)
+        speckle = (speckle - speckle.min()) / (speckle.max() - speckle.min())
+
+        y, x = np.mgrid[:height, :width]
+        radius = np.hypot((x - self.center[0]) / self.axes[0], (y - self.center[1]) / self.axes[1])
+        tissue = np.full(self.shape, 0.35)
+        tissue[radius < WALLS["epi"]] = 0.8
+        tissue[radius < WALLS["endo"]] = 0.15
+
+        self.base = tissue * (0.4 + 0.6 * speckle)
+
+    def scale(self, n: int) -> float:
+        return 1 - self.amplitude * (1 - np.cos(2 * np.pi * n / self.frames)) / 2
+
+    def array(self) -> np.ndarray:
+        frames = np.empty((self.frames, *self.shape), dtype=np.uint8)
+        for n in range(self.frames):
+            k = self.scale(n)
+            frame = warp(self.base, lambda xy: self.center + (xy - self.center) / k, mode="reflect")
+            frames[n] = np.rint(frame * 255)
+        return frames
+
+    def mask(self, wall: str) -> np.ndarray:
+        """Open arc of the wall without the base sector, as drawn in Paint"""
+        axes = self.axes * WALLS[wall]
+        phi = np.linspace(-np.pi, np.pi, int(8 * axes.sum()), endpoint=False)
+        phi = phi[np.abs(phi - np.pi / 2) > 0.5]
+
+        x = np.rint(self.center[0] + axes[0] * np.cos(phi)).astype(int)
+        y = np.rint(self.center[1] + axes[1] * np.sin(phi)).astype(int)
+
+        mask = np.zeros(self.shape, dtype=bool)
+        mask[y, x] = True
+        return mask
+
+    def truth(self, points: np.ndarray, n: int) -> np.ndarray:
+        return self.center + (points - self.center) * self.scale(n) / self.scale(0)
+
+
+def timed(function, repeat: int) -> tuple:
+    elapsed = []
+    for _ in range(repeat):
+        start = perf_counter()
+        result = function()
+        elapsed.append(perf_counter() - start)
+    return result, min(elapsed)
+
+
+def track(sequence: Sequence, stack: FrameStack, amount_points: int, profiler: Profiler, regularize: bool) -> dict:
+    tracker = LucasKanade(amount_points, None)
+    tracker.profiler = profiler
+    tracker.regularize = regularize
+    released = []
+    tracker.released.connect(released.append)
+    tracker.contours = {wall: sequence.mask(wall) for wall in WALLS}
+    tracker.files = stack
+    tracker.run()
+    return released[0]
+
+
+def run_case(height: int, width: int, frames: int, amount_points: int, repeat: int, profile: bool,
+             regularize: bool = False) -> dict:
+    sequence = Sequence(height, width, frames)
+    array = sequence.array()
+    mask = sequence.mask("endo")
+    cont_y, cont_x = np.nonzero(_area2cont(mask))
+
+    _, area2cont = timed(lambda: _area2cont(mask), repeat)
+    _, main_points = timed(lambda: _get_main_points(cont_y, cont_x, mask.shape), repeat)
+    _, get_points = timed(lambda: _get_points(mask, amount_points), repeat)
+
+    profiler = Profiler(profile)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    result, elapsed = timed(lambda: track(sequence, FrameStack(ArrayFrames(array)), amount_points, profiler, regularize),
+                             repeat)
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+
+    errors = []
+    for wall in WALLS:
+        contours = np.array([[(point.x(), point.y()) for point in contour] for contour in result[wall]])
+        truth = np.array([sequence.truth(contours[0], n) for n in range(frames)])
+        errors.append(np.linalg.norm(contours[1:] - truth[1:], axis=2))
+    errors = np.concatenate(errors, axis=1)
+
+    pairs = frames - 1
+    return {
+        "height": height,
+        "width": width,
+        "frames": frames,
+        "points": amount_points,
+        "walls": len(WALLS),
+        "regularize": regularize,
+        "seconds": elapsed,
+        "frames_per_second": pairs / elapsed,
+        "points_per_second": pairs * amount_points * len(WALLS) / elapsed,
+        "peak_memory_bytes": peak,
+        "mean_endpoint_error": float(errors.mean()),
+        "max_endpoint_error": float(errors.max()),
+        "reliable_fraction": float(np.mean([result["reliability"][wall][1:, :, 3] for wall in WALLS])),
+        "seeding_seconds": {
+            "_area2cont": area2cont,
+            "_get_main_points": main_points,
+            "_get_points": get_points
+        },
+        "stages": profiler.report()
+    }
+
+
+def sizes(value: str) -> list:
+    return [tuple(int(side) for side in size.split("x")) for size in value.split(",")]
+
+
+def numbers(value: str) -> list:
+    return [int(number) for number in value.split(",")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the tracker on synthetic echo sequences")
+    parser.add_argument("--sizes", type=sizes, default=sizes("256x256,512x512"), help="HxW list, e.g. 256x256,600x800")
+    parser.add_argument("--frames", type=numbers, default=numbers("10,30"))
+    parser.add_argument("--points", type=numbers, default=numbers("25,49"))
+    parser.add_argument("--repeat", type=int, default=1, help="best of N runs per case")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--profile", action="store_true", help="record per-stage timings of the tracker")
+    parser.add_argument("--regularize", action="store_true", help="track with the shape-regularized contours")
+    args = parser.parse_args()
+
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+
+    cases = []
+    for (height, width), frames, amount_points in product(args.sizes, args.frames, args.points):
+        case = run_case(height, width, frames, amount_points, args.repeat, args.profile, args.regularize)
+        cases.append(case)
+        print(f"{height}x{width} {frames:>4} frames {amount_points:>4} points  "
+              f"{case['frames_per_second']:8.2f} fps {case['points_per_second']:10.1f} pts/s  "
+              f"{case['peak_memory_bytes'] / 2 ** 20:8.1f} MiB  EPE {case['mean_endpoint_error']:6.2f} px")
+
+    with open(args.output, "w") as file:
+        json.dump({
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "cases": cases
+        }, file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,126 @@
+import os
+import time
+import atexit
 from configparser import ConfigParser
-from shutil import copy
+from threading import Lock, Timer
+
+import resources
+
+SECTION = "SETTINGS"
+STALE_LOCK = 5.0
+
+
+class Settings:
+    def __init__(self, path: str = os.path.join(resources.ROOT, "settings"), default: str = resources.path("default"),
+                 delay: float = 1.0):
+        # Absolute, so the temp file, the lock and the replace target don't follow the working directory
+        self.path = os.path.abspath(path)
+        self.delay = delay
+
+        self._defaults = self._read(default)
+        self._values = dict(self._defaults)
+        self._values.update({field: value for field, value in self._read(path).items() if field in self._defaults})
+
+        self._dirty = {}
+        self._timer = None
+        self._lock = Lock()
+
+        atexit.register(self.flush)
+
+    @staticmethod
+    def _read(path: str) -> dict:
+        config = ConfigParser()
+        config.read(path)
+        return dict(config[SECTION]) if config.has_section(SECTION) else {}
+
+    def _field(self, field: str) -> str:
+        field = field.lower()
+        if field not in self._defaults:
+            raise KeyError(f"Unknown setting {field}")
+        return field
+
+    def get(self, field: str) -> str:
+        return self._values[self._field(field)]
+
+    def set(self, field: str, value: str) -> None:
+        field = self._field(field)
+        with self._lock:
+            if self._values[field] == value and field not in self._dirty:
+                return
+            self._values[field] = value
+            self._dirty[field] = value
+            if self._timer is None:
+                self._timer = Timer(self.delay, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self) -> None:
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            dirty, self._dirty = self._dirty, {}
+
+        if not dirty:
+            return
+
+        lock = self._acquire()
+        try:
+            # Merge into the file as it is now, so fields changed by another instance survive
+            config = ConfigParser()
+            config.read(self.path)
+            if not config.has_section(SECTION):
+                config.add_section(SECTION)
+            for field, value in self._defaults.items():
+                if not config.has_option(SECTION, field):
+                    config.set(SECTION, field, value)
+            for field, value in dirty.items():
+                config.set(SECTION, field, value)
+
+            temp = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp, "w") as file:
+                config.write(file)
+            os.replace(temp, self.path)
+        finally:
+            self._release(lock)
+
+    def _acquire(self) -> str:
+        """Take the lock file next to the settings so instances merge one at a time"""
+        lock = f"{self.path}.lock"
+        while True:
+            try:
+                os.close(os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return lock
+            except FileExistsError:
+                # Left behind by an instance that crashed while flushing
+                try:
+                    if time.time() - os.path.getmtime(lock) > STALE_LOCK:
+                        os.remove(lock)
+                except OSError:
+                    pass
+                time.sleep(0.01)
+
+    @staticmethod
+    def _release(lock: str) -> None:
+        try:
+            os.remove(lock)
+        except OSError:
+            pass
+
+
+_settings = None
+
+
+def settings() -> Settings:
+    global _settings
+    if _settings is None:
+        _settings = Settings()
+    return _settings
 
 
 def set_param(field: str, value: str) -> None:
-    config = ConfigParser()
-    config.read('settings')
-    if not config.sections():
-        copy("static/default", "settings")
-        config.read('settings')
-    config.set('SETTINGS', field, value)
-    with open('settings', 'w') as file:
-        config.write(file)
+    settings().set(field, value)
 
 
 def get_param(field: str) -> str:
-    config = ConfigParser()
-    config.read('settings')
-    try:
-        value = config['SETTINGS'][field]
-        return value
-    except KeyError:
-        copy("static/default", "settings")
-        return get_param(field)
+    return settings().get(field)
@@ -0,0 +1,121 @@
+import json
+import os.path
+
+import numpy as np
+from PyQt5.QtCore import QThread, QObject, pyqtSignal
+from skimage.draw import polygon
+from skimage.transform import pyramid_gaussian, resize, warp
+
+from frames import FrameStack
+
+
+def _box(image: np.ndarray, radius: int) -> np.ndarray:
+    """Sum over (2r + 1) x (2r + 1) windows from a summed-area table, edges clamped"""
+    size = 2 * radius + 1
+    table = np.pad(np.pad(image, radius, mode="edge").cumsum(0).cumsum(1), ((1, 0), (1, 0)))
+    return table[size:, size:] - table[:-size, size:] - table[size:, :-size] + table[:-size, :-size]
+
+
+def _warp(image: np.ndarray, flow: np.ndarray) -> np.ndarray:
+    rows, cols = np.mgrid[:image.shape[0], :image.shape[1]]
+    return warp(image, np.array([rows + flow[..., 1], cols + flow[..., 0]]), mode="edge")
+
+
+def dense_flow(layers1: list, layers2: list, radius: int = 7, iterations: int = 3) -> np.ndarray:
+    """Return (h, w, 2) flow (dx, dy) from pyramids of the first and the second image, finest layer first"""
+    flow = np.zeros((*layers1[-1].shape, 2))
+
+    for layer1, layer2 in zip(layers1[::-1], layers2[::-1]):
+        if flow.shape[:2] != layer1.shape:
+            flow = resize(flow, (*layer1.shape, 2), order=1, anti_aliasing=False) * 2
+
+        fy, fx = np.gradient(layer1)
+        ixx, ixy, iyy = _box(fx * fx, radius), _box(fx * fy, radius), _box(fy * fy, radius)
+        det = ixx * iyy - ixy ** 2
+        valid = det > 1e-9
+
+        for _ in range(iterations):
+            ft = _warp(layer2, flow) - layer1
+            bx, by = -_box(fx * ft, radius), -_box(fy * ft, radius)
+            flow[..., 0] += np.divide(iyy * bx - ixy * by, det, out=np.zeros_like(det), where=valid)
+            flow[..., 1] += np.divide(ixx * by - ixy * bx, det, out=np.zeros_like(det), where=valid)
+
+    return flow
+
+
+def myocardium(endo: list, epi: list, top: int, left: int, shape: tuple) -> np.ndarray:
+    """Mask of the ring between endo and epi contours"""
+    points = list(endo) + list(epi)[::-1]
+    rows = np.array([p.y() for p in points]) - top
+    cols = np.array([p.x() for p in points]) - left
+    mask = np.zeros(shape, dtype=bool)
+    mask[polygon(rows, cols, shape)] = True
+    return mask
+
+
+class DenseFlow(QThread):
+    progress = pyqtSignal(int)
+    released = pyqtSignal(str)
+
+    LEVELS = 2
+    RADIUS = 7
+    ITERATIONS = 3
+    MARGIN = 16
+
+    def __init__(self, parent: QObject):
+        super().__init__(parent)
+
+        self.files = None
+        self.contours = {}
+        self.path = None
+        self.stop = True
+
+    def begin(self, files: FrameStack, contours: dict, path: str) -> None:
+        self.files = files
+        self.contours = contours
+        self.path = path
+        self.stop = False
+        self.start()
+
+    def roi(self) -> tuple:
+        """Return top, left, bottom, right around both walls over all frames"""
+        x = [p.x() for wall in ("endo", "epi") for contour in self.contours[wall] for p in contour]
+        y = [p.y() for wall in ("endo", "epi") for contour in self.contours[wall] for p in contour]
+        height, width = self.files.shape[1:]
+        return (max(int(min(y)) - self.MARGIN, 0), max(int(min(x)) - self.MARGIN, 0),
+                min(int(max(y)) + self.MARGIN + 1, height), min(int(max(x)) + self.MARGIN + 1, width))
+
+    def run(self) -> None:
+        top, left, bottom, right = self.roi()
+        shape = bottom - top, right - left
+
+        # Flow n moves frame n to n + 1; outside the myocardium of frame n it is NaN
+        flow = np.lib.format.open_memmap(self.path, mode="w+", dtype=np.float16,
+                                         shape=(len(self.files) - 1, *shape, 2))
+
+        layers2 = list(pyramid_gaussian(self.files.gray(0)[top:bottom, left:right], max_layer=self.LEVELS))
+
+        for n in range(len(self.files) - 1):
+
+            if self.stop:
+                break
+
+            layers1 = layers2
+            layers2 = list(pyramid_gaussian(self.files.gray(n + 1)[top:bottom, left:right], max_layer=self.LEVELS))
+
+            field = dense_flow(layers1, layers2, self.RADIUS, self.ITERATIONS)
+            mask = myocardium(self.contours["endo"][n], self.contours["epi"][n], top, left, shape)
+            flow[n] = np.where(mask[..., None], field, np.nan)
+
+            self.progress.emit(n)
+
+        flow.flush()
+        del flow
+
+        with open(f"{os.path.splitext(self.path)[0]}.json", "w") as file:
+            json.dump({"top": top, "left": left, "frames": self.files.names(), "complete": not self.stop}, file)
+
+        self.files = None
+        self.contours = {}
+
+        self.released.emit(self.path)
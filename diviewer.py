@@ -4,8 +4,10 @@ from PyQt5.QtGui import *
 from PyQt5.QtCore import *
 from qimage2ndarray import array2qimage as np2qim
 import os
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
 from support import Utils, EntryLine
 from config import get_param, set_param
+import resources
 
 from PIL.Image import fromarray
 from PIL.ImageDraw import Draw
@@ -156,11 +158,14 @@ class HandlerFrames(QWidget):
             frames.addFrame(str(n))
 
         layout_buttons = QHBoxLayout()
+        track = QPushButton("Track")
+        track.setObjectName("Track")
         save = QPushButton("Save")
         save.setObjectName("Save")
         cancel = QPushButton("Cancel")
         cancel.setObjectName("Cancel")
 
+        layout_buttons.addWidget(track)
         layout_buttons.addWidget(save)
         layout_buttons.addWidget(cancel)
 
@@ -238,9 +243,41 @@ class HandlerFrames(QWidget):
                 pass
 
 
+_font = None
+
+
+def _init_converter(font: str, size: int) -> None:
+    global _font
+    _font = truetype(font, size)
+
+
+def _convert_frame(array: np.ndarray, path: str, text: str, sys_exist: bool, options: dict) -> None:
+    channel = array.shape[-1]
+    if channel not in (3, 4):
+        array = gray2rgb(array)
+    array = np.pad(array, ((16, 0), (0, 0), (0, 0)), "constant")
+
+    image = fromarray(array)
+    draw = Draw(image)
+
+    textlen = draw.textlength(text, _font)
+    draw.text((image.width - textlen - 5, 0), text=text, font=_font)
+
+    if options["format"] == "png":
+        metadata = PngInfo()
+        if sys_exist:
+            metadata.add_text("sys_id", "1")
+        image.save(path, pnginfo=metadata, compress_level=options["compress_level"])
+    else:
+        image.save(path)
+
+
 class Converter(QThread):
     progress = pyqtSignal(int)
 
+    FORMATS = ("png", "tiff", "bmp")
+    COMPRESS_LEVEL = 1
+
     def __init__(self, data: np.ndarray, parent: QObject):
         super().__init__(parent)
         self.data = data
@@ -250,45 +287,62 @@ class Converter(QThread):
     def begin(self, dir: str, result: dict) -> None:
         self.dir = dir
         self.result = result
+
+        format = get_param("dicom_save_format").lower()
+        if format not in Converter.FORMATS:
+            format = "png"
+        try:
+            compress_level = min(max(int(get_param("png_compress_level")), 0), 9)
+        except ValueError:
+            compress_level = Converter.COMPRESS_LEVEL
+        self.options = {"format": format, "compress_level": compress_level}
+
         self.start()
         self.stop = False
 
     def run(self) -> None:
         fcount = len(self.result["numbers"])
-        font = truetype("static/fonts/HelveticaNowDisplay-Bold.ttf", 14)
-
-        for n, fn in enumerate(self.result["numbers"]):
-
-            if self.stop:
-                break
-
-            array = self.data[fn]
-            channel = array.shape[-1]
-            if channel not in (3, 4):
-                array = gray2rgb(array)
-            array = np.pad(array, ((16, 0), (0, 0), (0, 0)), "constant")
-
-            image = fromarray(array)
-            draw = Draw(image)
-
-            sys = self.result.get("sys")
-            sys_exist = sys is not None and sys == fn
-
-            text = f"(s) {n + 1} / {fcount}" if sys_exist else f"{n + 1} / {fcount}"
-            textlen = draw.textlength(text, font)
-            draw.text((image.width - textlen - 5, 0), text=text, font=font)
+        sys = self.result.get("sys")
+        ext = self.options["format"]
+        workers = os.cpu_count() or 1
+
+        frames = iter(enumerate(self.result["numbers"]))
+        pending = set()
+        done = 0
+
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_converter,
+                                 initargs=(resources.path("fonts", "HelveticaNowDisplay-Bold.ttf"), 14)) as executor:
+            while True:
+                while not self.stop and len(pending) < workers * 2:
+                    try:
+                        n, fn = next(frames)
+                    except StopIteration:
+                        break
+
+                    sys_exist = sys is not None and sys == fn
+                    text = f"(s) {n + 1} / {fcount}" if sys_exist else f"{n + 1} / {fcount}"
+                    name = f"{n + 1}s.{ext}" if sys_exist else f"{n + 1}.{ext}"
+                    pending.add(executor.submit(_convert_frame, self.data[fn], os.path.join(self.dir, name),
+                                                text, sys_exist, self.options))
+
+                if not pending:
+                    break
 
-            if sys_exist:
-                metadata = PngInfo()
-                metadata.add_text("sys_id", "1")
-                image.save(os.path.join(self.dir, f"{n + 1}s.png"), pnginfo=metadata)
-            else:
-                image.save(os.path.join(self.dir, f"{n + 1}.png"))
+                if self.stop:
+                    for future in pending:
+                        future.cancel()
+                    break
 
-            self.progress.emit(n)
+                completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    future.result()
+                    self.progress.emit(done)
+                    done += 1
 
         del self.result
         del self.dir
+        del self.options
 
 
 class SaveDialog(QDialog):
@@ -371,6 +425,8 @@ class InputDialog(QDialog):
 
 
 class Diviewer(QDialog):
+    TRACK = 2
+
     def __init__(self, data: np.ndarray):
         super().__init__()
 
@@ -381,8 +437,7 @@ class Diviewer(QDialog):
         self.setWindowFlag(Qt.WindowMinimizeButtonHint)
         self.data = data
 
-        with open("static/styles/diviewer.css", "r") as style:
-            self.setStyleSheet(style.read())
+        self.setStyleSheet(resources.stylesheet("diviewer"))
 
         layout = QHBoxLayout()
         layout.setContentsMargins(0, 0, 0, 0)
@@ -407,6 +462,9 @@ class Diviewer(QDialog):
             list: QListWidget = handlerFrames.findChild(QListWidget)
             list.currentRowChanged.connect(lambda row: frame.setFrame(self.data[row]))
 
+            track: QPushButton = handlerFrames.findChild(QPushButton, "Track")
+            track.setCursor(Qt.PointingHandCursor)
+            track.clicked.connect(self.track_frames)
             save: QPushButton = handlerFrames.findChild(QPushButton, "Save")
             save.setCursor(Qt.PointingHandCursor)
             save.clicked.connect(self.save_files)
@@ -426,6 +484,20 @@ class Diviewer(QDialog):
     def keyPressEvent(self, event: QKeyEvent):
         pass
 
+    def track_frames(self) -> None:
+        frames = self.findChild(HandlerFrames)
+        result = frames.result()
+
+        if not result.get("numbers"):
+            return
+
+        self.tracking = {"numbers": result["numbers"]}
+
+        if result.get("sys") is not None:
+            self.tracking["sys_id"] = result["sys"] + 1
+
+        self.done(Diviewer.TRACK)
+
     def save_files(self) -> None:
         frames = self.findChild(HandlerFrames)
         result = frames.result()
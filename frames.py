@@ -0,0 +1,278 @@
+import os
+import re
+import hashlib
+from abc import ABC, abstractmethod
+from itertools import count
+from collections import OrderedDict
+from threading import Lock
+from typing import Union, Callable
+
+import numpy as np
+from PyQt5.QtGui import QImage
+from qimage2ndarray import rgb_view, array2qimage
+
+
+class FrameSource(ABC):
+    _tokens = count()
+
+    @abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    @abstractmethod
+    def read(self, index: int) -> np.ndarray:
+        """Return frame as uint8 (h, w) or (h, w, 3)"""
+
+    def name(self, index: int) -> str:
+        return str(index + 1)
+
+    def path(self, index: int) -> Union[str, None]:
+        return None
+
+    def key(self, index: int) -> tuple:
+        if not hasattr(self, "_token"):
+            self._token = next(FrameSource._tokens)
+        return self._token, index
+
+    def digest(self, index: int) -> str:
+        """Identity of the frame that stays the same across sessions, a content hash unless the frame is a file"""
+        return hashlib.blake2b(self.read(index).tobytes(), digest_size=20).hexdigest()
+
+
+class ImageFiles(FrameSource):
+    def __init__(self, paths: list):
+        self.paths = list(paths)
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    def read(self, index: int) -> np.ndarray:
+        image = QImage(self.paths[index])
+        if image.isNull():
+            raise OSError(f"Can't read image {self.paths[index]}")
+        return np.array(rgb_view(image.convertToFormat(QImage.Format_RGB32)))
+
+    def name(self, index: int) -> str:
+        return os.path.splitext(os.path.basename(self.paths[index]))[0]
+
+    def path(self, index: int) -> str:
+        return self.paths[index]
+
+    def key(self, index: int) -> tuple:
+        return self.paths[index],
+
+    def digest(self, index: int) -> str:
+        return file_stamp(self.paths[index])
+
+
+class ArrayFrames(FrameSource):
+    def __init__(self, array: Union[np.ndarray, str]):
+        if isinstance(array, str):
+            array = np.load(array, mmap_mode="r")
+        self.array = array
+        self._peak = None
+
+    def __len__(self) -> int:
+        return 0 if self.array is None else self.array.shape[0]
+
+    def read(self, index: int) -> np.ndarray:
+        frame = self.array[index]
+        if frame.ndim == 3:
+            frame = frame[:, :, :3]
+        if frame.dtype != np.uint8:
+            if self._peak is None:
+                self._peak = max(int(self.array.max()), 255)
+            frame = np.rint(frame * (255 / self._peak)).astype(np.uint8)
+        return np.ascontiguousarray(frame)
+
+
+class DicomFile(ArrayFrames):
+    def __init__(self, path: str):
+        from pydicom import dcmread
+        from pydicom.pixel_data_handlers import convert_color_space
+
+        dicom = dcmread(path)
+        data = None
+
+        if "PixelData" in dicom:
+            data = dicom.pixel_array
+            if "PhotometricInterpretation" in dicom:
+                interp = dicom.PhotometricInterpretation
+                if interp in ("YBR_FULL_422", "YBR_FULL"):
+                    data = convert_color_space(data, interp, "RGB")
+
+        super().__init__(data)
+        self.file = path
+
+    def key(self, index: int) -> tuple:
+        return self.file, index
+
+    def digest(self, index: int) -> str:
+        return f"{file_stamp(self.file)}:{index}"
+
+
+class FrameCache:
+    def __init__(self, size: int = 32):
+        self._size = size
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: tuple, load: Callable[[], np.ndarray]) -> np.ndarray:
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                return self._data[key]
+
+        value = load()
+        value.flags.writeable = False
+
+        with self._lock:
+            self._data[key] = value
+            while len(self._data) > self._size:
+                self._data.popitem(last=False)
+
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+class FrameStack:
+    GRAY_WEIGHTS = np.array([0.2125, 0.7154, 0.0721])
+
+    def __init__(self, source: FrameSource, indexes: Union[range, list] = None, cache: FrameCache = None):
+        self.source = source
+        self.indexes = range(len(source)) if indexes is None else indexes
+        self.cache = FrameCache() if cache is None else cache
+
+    def __len__(self) -> int:
+        return len(self.indexes)
+
+    def __getitem__(self, key: Union[int, slice]) -> Union[np.ndarray, "FrameStack"]:
+        if isinstance(key, slice):
+            return FrameStack(self.source, self.indexes[key], self.cache)
+        return self.rgb(key)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self.rgb(n)
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self), *self.rgb(0).shape[:2])
+
+    @property
+    def dtype(self) -> np.dtype:
+        return np.dtype(np.uint8)
+
+    def _raw(self, index: int) -> np.ndarray:
+        source_index = self.indexes[index]
+        return self.cache.get(("raw", self.source.key(source_index)), lambda: self.source.read(source_index))
+
+    def rgb(self, index: int) -> np.ndarray:
+        frame = self._raw(index)
+        if frame.ndim == 3:
+            return frame
+        return self.cache.get(("rgb", self.key(index)), lambda: np.dstack((frame, frame, frame)))
+
+    @staticmethod
+    def _gray(frame: np.ndarray) -> np.ndarray:
+        if frame.ndim == 3:
+            return frame @ (FrameStack.GRAY_WEIGHTS / 255)
+        return frame / 255
+
+    def gray(self, index: int, box: tuple = None) -> np.ndarray:
+        """Return float frame in [0, 1], only the top, left, bottom, right box of it if given"""
+        if box is not None:
+            top, left, bottom, right = box
+            return self._gray(self._raw(index)[top:bottom, left:right])
+
+        return self.cache.get(("gray", self.key(index)), lambda: self._gray(self._raw(index)))
+
+    def image(self, index: int) -> QImage:
+        return array2qimage(self._raw(index))
+
+    def key(self, index: int) -> tuple:
+        return self.source.key(self.indexes[index])
+
+    def name(self, index: int) -> str:
+        return self.source.name(self.indexes[index])
+
+    def names(self) -> list:
+        return [self.name(n) for n in range(len(self))]
+
+    def path(self, index: int) -> Union[str, None]:
+        return self.source.path(self.indexes[index])
+
+    def digest(self, index: int) -> str:
+        return self.source.digest(self.indexes[index])
+
+
+def file_stamp(path: str) -> str:
+    """Path, size and modification time, a stat away even for large studies on network shares"""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+IMAGE_EXTS = ("jpeg", "jpg", "png", "bmp", "tif", "tiff")
+TEXT_EXTS = ("txt",)
+
+_scans = {}
+
+
+def natural_key(name: str) -> list:
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+
+def scan_study(dir: str) -> dict:
+    mtime = os.stat(dir).st_mtime_ns
+    cached = _scans.get(dir)
+
+    if cached is None or cached[0] != mtime:
+        contours = {"endo": [], "epi": []}
+        images = {"endo": None, "epi": None}
+        frames = []
+        sys_name = None
+
+        with os.scandir(dir) as entries:
+            for entry in entries:
+
+                if entry.is_dir():
+                    continue
+
+                name, ext = os.path.splitext(entry.name)
+                ext = ext[1:].lower()
+
+                if ext in TEXT_EXTS and name.endswith("_endo"):
+                    contours["endo"].append(entry.path)
+                elif ext in TEXT_EXTS and name.endswith("_epi"):
+                    contours["epi"].append(entry.path)
+                elif ext in IMAGE_EXTS and name.endswith("_endo"):
+                    images["endo"] = entry.path
+                elif ext in IMAGE_EXTS and name.endswith("_epi"):
+                    images["epi"] = entry.path
+                elif ext in IMAGE_EXTS:
+                    key = natural_key(name)
+                    frames.append((key, entry.path))
+                    if name.endswith("s") and (sys_name is None or key < sys_name):
+                        sys_name = key
+
+        frames.sort()
+        keys = [key for key, _ in frames]
+
+        cached = mtime, {
+            "ready_contours": {wall: sorted(paths, key=natural_key) for wall, paths in contours.items()},
+            "ready_images": images,
+            "frames": [path for _, path in frames],
+            "sys_index": keys.index(sys_name) if sys_name is not None else -1
+        }
+        _scans[dir] = cached
+
+    result = cached[1]
+    return {
+        "ready_contours": {wall: list(paths) for wall, paths in result["ready_contours"].items()},
+        "ready_images": dict(result["ready_images"]),
+        "frames": list(result["frames"]),
+        "sys_index": result["sys_index"]
+    }
@@ -5,13 +5,8 @@ from PyQt5.QtGui import QMouseEvent, QIntValidator
 from PyQt5.QtCore import QObject, Qt, QPoint, QPointF
 
 from config import get_param, set_param
-from options import Options
-from paint import Paint
-from workspace import Workspace
-from diviewer import Diviewer
+import resources
 
-from pydicom import dcmread, errors
-from pydicom.pixel_data_handlers import convert_color_space
 from pathlib import Path
 
 from typing import Union
@@ -59,8 +54,7 @@ class Home(QWidget):
 
         self.setObjectName("home")
 
-        with open("static/styles/home.css", "r") as style:
-            self.setStyleSheet(style.read())
+        self.setStyleSheet(resources.stylesheet("home"))
 
         layout = QVBoxLayout()
         layout.setAlignment(Qt.AlignCenter)
@@ -114,6 +108,10 @@ class Home(QWidget):
         self.setFocus()
 
     def dicom_viewer(self) -> None:
+        from pydicom import errors
+        from frames import FrameStack, DicomFile
+        from diviewer import Diviewer
+
         file = QFileDialog.getOpenFileName(
             self,
             caption="Select DICOM file",
@@ -126,7 +124,7 @@ class Home(QWidget):
         set_param("open_dicom_dir_path", os.path.dirname(file[0]))
 
         try:
-            dicom = dcmread(file[0])
+            dicom = DicomFile(file[0])
         except (errors.InvalidDicomError, TypeError):
             msg = QMessageBox()
             msg.setIcon(QMessageBox.Critical)
@@ -135,71 +133,40 @@ class Home(QWidget):
             msg.exec_()
             return
 
-        data = None
-
-        if "PixelData" in dicom:
-            data = dicom.pixel_array
-            if "PhotometricInterpretation" in dicom:
-                interp = dicom.PhotometricInterpretation
-                if interp in ("YBR_FULL_422", "YBR_FULL"):
-                    data = convert_color_space(data, interp, "RGB")
-
-        del dicom
-
-        if data is None:
+        if dicom.array is None:
             return
 
+        if self.resume_session({"dir": os.path.dirname(file[0]), "title": Path(file[0]).stem,
+                                "frames": FrameStack(dicom)}):
+            return
 
-        diviewer = Diviewer(data)
+        diviewer = Diviewer(dicom.array)
         self.hide()
-        diviewer.exec_()
+        answer = diviewer.exec_()
         self.show()
         diviewer.deleteLater()
 
+        if answer == Diviewer.TRACK:
+            tracking = diviewer.tracking
+            tracking["frames"] = FrameStack(dicom, tracking.pop("numbers"))
+            self.gallery_dicom_frames(tracking, file[0])
+
     def get_data(self, dir: str) -> dict:
+        from frames import scan_study
 
         amount_points = int(self.findChild(EntryLine, "amount_of_points").getText())
         step_processing = int(self.findChild(EntryLine, "step_processing").getText())
 
-        data = {
-            "ready_contours": {
-                "endo": [],
-                "epi": []
-            },
-            "ready_images": {
-                "endo": None,
-                "epi": None
-            },
-            "amount_points": amount_points,
-            "step_processing": step_processing,
-            "frames": []
-        }
-
-        txt_exts = ("txt")
-        img_exts = ("jpeg", "jpg", "png", "bmp")
-
         try:
-            for file in os.listdir(dir):
-
-                if os.path.isdir(os.path.join(dir, file)):
-                    continue
-
-                name, ext = file.split(".")
-                path_file = os.path.join(dir, file)
-
-                if ext in txt_exts and name.endswith("_endo"):
-                    data["ready_contours"]["endo"].append(path_file)
-                elif ext in txt_exts and name.endswith("_epi"):
-                    data["ready_contours"]["epi"].append(path_file)
-                elif ext in img_exts and name.endswith("_endo"):
-                    data["ready_images"]["endo"] = path_file
-                elif ext in img_exts and name.endswith("_epi"):
-                    data["ready_images"]["epi"] = path_file
-                elif ext in img_exts:
-                    data["frames"].append(path_file)
+            data = scan_study(dir)
         except PermissionError:
             return {}
 
+        data["amount_points"] = amount_points
+        data["step_processing"] = step_processing
+        data["dir"] = dir
+        data["title"] = os.path.basename(dir)
+
         return data
 
     def exist_ready_data(self, data: dict) -> bool:
@@ -215,19 +182,6 @@ class Home(QWidget):
             exist_ready_images = False
             del data["ready_images"]
 
-        try:
-
-            def key(path: str) -> int:
-                name = Path(path).stem
-                try:
-                    return int("".join([v for v in name if v.isdigit()]))
-                except ValueError:
-                    return float("inf")
-
-            data["frames"].sort(key=key)
-        except:
-            print("Failed sorting")
-
         return exist_ready_contours or exist_ready_images
 
     def read_ready_file(self, path: str) -> Union[tuple, dict]:
@@ -265,6 +219,7 @@ class Home(QWidget):
         return data_file
 
     def upload_files(self) -> None:
+        from frames import FrameStack, ImageFiles
 
         dir = QFileDialog.getExistingDirectory(caption="Select directory with images",
                                                directory=get_param("UPLOAD_DIR_PATH"))
@@ -276,15 +231,87 @@ class Home(QWidget):
 
             data = self.get_data(dir)
 
-            if data.get("frames") is None:
+            if not data.get("frames"):
+                return
+
+            exist_ready_data = self.exist_ready_data(data)
+            data["frames"] = FrameStack(ImageFiles(data["frames"]))
+
+            if self.resume_session(data):
                 return
 
-            if self.exist_ready_data(data):
+            if exist_ready_data:
                 self.open_options(data)
             else:
                 self.gallery_new_contours(data)
 
+    def resume_session(self, data: dict) -> bool:
+        from journal import Journal
+        from workspace import Workspace
+        from frames import FrameStack, DicomFile
+
+        session = Journal.load(Journal.path_for(data["dir"], data["title"]))
+
+        if session is None or session["saved"]:
+            return False
+
+        frames = data["frames"]
+        if isinstance(frames.source, DicomFile):
+            # DICOM sessions track the frames selected in Diviewer, named by their number in the file
+            try:
+                indexes = [int(name) - 1 for name in session.get("frames", [])]
+            except ValueError:
+                return False
+            if not indexes or not all(0 <= index < len(frames) for index in indexes):
+                return False
+            frames = FrameStack(frames.source, indexes)
+        else:
+            frames = frames[::session.get("step", 1)]
+
+        if frames.names() != session.get("frames"):
+            return False
+
+        ready_contours = {}
+        for wall, saved in session["contours"].items():
+            contours = []
+            while len(contours) in saved:
+                contours.append([QPointF(x, y) for x, y in saved[len(contours)]])
+            if contours:
+                ready_contours[wall] = contours
+
+        if not ready_contours:
+            return False
+
+        quest = QMessageBox()
+        quest.setWindowTitle("Resume")
+        quest.setText("Unsaved contours from the previous session were found. Resume?")
+        quest.addButton(QMessageBox.Yes)
+        quest.addButton(QMessageBox.No)
+        if quest.exec_() != QMessageBox.Yes:
+            return False
+
+        scale_start, scale_end = session.get("scale_start"), session.get("scale_end")
+
+        source_data = {
+            "ready_contours": ready_contours,
+            "amount_points": len(next(iter(ready_contours.values()))[0]),
+            "dir": data["dir"],
+            "title": data["title"],
+            "frames": frames,
+            "sys_id": session.get("sys_id", -1),
+            "scale_start": None if scale_start is None else QPoint(*scale_start),
+            "scale_end": None if scale_end is None else QPoint(*scale_end),
+            "resumed": True
+        }
+
+        self.workspace = Workspace(source_data)
+        self.workspace.show()
+        return True
+
     def open_options(self, data: dict) -> None:
+        from options import Options
+        from paint import Paint
+
         options = Options(data)
         answer = options.exec_()
 
@@ -316,20 +343,17 @@ class Home(QWidget):
         elif answer == Options.IMAGES:
             self.gallery_ready_images(data)
 
-    def find_sys_id(self, frames: list, step: int) -> int:
-        ids = list(filter(lambda file: Path(file).stem.endswith("s"), frames))
-        try:
-            index = frames.index(ids[0])
-            left = step * (index // step)
-            right = left + step
-            index = left if abs(left - index) <= abs(right - index) else right
-            # frame = Path(frames[index]).stem
-            # return int(frame[:-1]) if frame.endswith("s") else int(frame)
-            return index + 1
-        except IndexError:
+    def find_sys_id(self, index: int, step: int) -> int:
+        if index < 0:
             return -1
+        left = step * (index // step)
+        right = left + step
+        index = left if abs(left - index) <= abs(right - index) else right
+        return index + 1
 
     def gallery_ready_contours(self, source_data: dict, data_files: dict) -> None:
+        from workspace import Workspace
+
         frames = source_data.get("frames")
         endo = data_files.get("endo")
         epi = data_files.get("epi")
@@ -365,7 +389,7 @@ class Home(QWidget):
         del source_data["step_processing"]
         del source_data["amount_points"]
 
-        source_data["frames"] = [source_data["frames"][n] for n in range(0, len(source_data["frames"]), step)]
+        source_data["frames"] = source_data["frames"][::step]
         source_data["sys_id"] = sys_id
         source_data["scale_start"] = scale_start
         source_data["scale_end"] = scale_end
@@ -374,6 +398,9 @@ class Home(QWidget):
         self.workspace.show()
 
     def gallery_ready_contour(self, source_data: dict, type: int, data_file: dict) -> None:
+        from paint import Paint
+        from workspace import Workspace
+
         frames = source_data.get("frames")
         contours = data_file.get("contours")
         sys_id = data_file.get("sys_id")
@@ -387,11 +414,12 @@ class Home(QWidget):
         if scale_end == QPoint(-1, -1):
             scale_end = None
 
-        paint = Paint(background=frames[0],
+        paint = Paint(background=frames,
                       type=type,
                       contour=contours[0],
                       scale_start=scale_start,
-                      scale_end=scale_end)
+                      scale_end=scale_end,
+                      title=source_data.get("title"))
 
         draw_result = paint.exec_()
 
@@ -419,16 +447,40 @@ class Home(QWidget):
         if len(frames) != len(contours):
             step = round(len(frames) / len(contours))
 
-        source_data["sys_id"] = int(sys_id) if data_file.get("sys_id") is not None else self.find_sys_id(frames, step)
-        source_data["frames"] = [source_data["frames"][n] for n in range(0, len(source_data["frames"]), step)]
+        if data_file.get("sys_id") is not None:
+            source_data["sys_id"] = int(sys_id)
+        else:
+            source_data["sys_id"] = self.find_sys_id(source_data.get("sys_index", -1), step)
+        source_data["frames"] = source_data["frames"][::step]
 
         self.workspace = Workspace(source_data)
         self.workspace.show()
 
+    def gallery_dicom_frames(self, tracking: dict, file: str) -> None:
+        amount_points = self.findChild(EntryLine, "amount_of_points").getText()
+        set_param("AMOUNT_OF_POINTS", amount_points)
+
+        source_data = {
+            "ready_contours": {},
+            "amount_points": int(amount_points),
+            "step_processing": 1,
+            "dir": os.path.dirname(file),
+            "title": Path(file).stem,
+            "frames": tracking.get("frames")
+        }
+
+        if tracking.get("sys_id") is not None:
+            source_data["sys_id"] = tracking.get("sys_id")
+
+        self.gallery_new_contours(source_data)
+
     def gallery_new_contours(self, source_data: dict) -> None:
+        from paint import Paint
+        from workspace import Workspace
+
         frames = source_data.get("frames")
         step = source_data.get("step_processing")
-        paint = Paint(background=frames[0])
+        paint = Paint(background=frames, title=source_data.get("title"))
         draw_result = paint.exec_()
 
         if not draw_result or (draw_result.get("endo") is None and draw_result.get("epi") is None):
@@ -442,12 +494,13 @@ class Home(QWidget):
         if draw_result.get("epi") is not None:
             source_data["ready_contours"]["epi"] = draw_result.get("epi")
 
-        source_data["sys_id"] = self.find_sys_id(frames, step)
+        if source_data.get("sys_id") is None:
+            source_data["sys_id"] = self.find_sys_id(source_data.get("sys_index", -1), step)
         source_data["scale_start"] = draw_result.get("scale_start")
         source_data["scale_end"] = draw_result.get("scale_end")
 
         if step > 1:
-            source_data["frames"] = [source_data["frames"][n] for n in range(0, len(source_data["frames"]), step)]
+            source_data["frames"] = source_data["frames"][::step]
 
         del source_data["step_processing"]
 
@@ -455,13 +508,14 @@ class Home(QWidget):
         self.workspace.show()
 
     def gallery_ready_images(self, source_data: dict) -> None:
-        frames = source_data.get("frames")
+        from workspace import Workspace
+
         step = source_data.get("step_processing")
         source_data["ready_contours"] = source_data["ready_images"]
-        source_data["sys_id"] = self.find_sys_id(frames, step)
+        source_data["sys_id"] = self.find_sys_id(source_data.get("sys_index", -1), step)
 
         if step > 1:
-            source_data["frames"] = [source_data["frames"][n] for n in range(0, len(source_data["frames"]), step)]
+            source_data["frames"] = source_data["frames"][::step]
 
         del source_data["ready_images"]
         self.workspace = Workspace(source_data)
@@ -0,0 +1,93 @@
+import os
+import json
+from queue import Queue
+from threading import Thread
+from typing import Union
+
+
+class Journal:
+    """Append-only log of a Workspace session, one JSON record per line, written off the UI thread"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue = Queue()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def path_for(dir: str, title: str) -> str:
+        return os.path.join(dir, f"{title}.journal")
+
+    @staticmethod
+    def frame(wall: str, number: int, points: list) -> dict:
+        return {"wall": wall, "frame": number, "points": [(round(p.x(), 2), round(p.y(), 2)) for p in points]}
+
+    def start(self, header: dict, records: list) -> None:
+        """Replace the journal with a new session header and a snapshot of its frames"""
+        self._queue.put(("w", [dict(header, session=1)] + records))
+
+    def append(self, records: list) -> None:
+        self._queue.put(("a", records))
+
+    def saved(self) -> None:
+        self.append([{"saved": True}])
+
+    def close(self, remove: bool = False) -> None:
+        self._queue.put(None)
+        self._thread.join()
+        if remove:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+
+            mode, records = item
+            lines = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+
+            try:
+                if mode == "w":
+                    temp = f"{self.path}.{os.getpid()}.tmp"
+                    with open(temp, "w") as file:
+                        file.write(lines)
+                    os.replace(temp, self.path)
+                else:
+                    with open(self.path, "a") as file:
+                        file.write(lines)
+            except OSError:
+                print("Journal wasn't written")
+
+    @staticmethod
+    def load(path: str) -> Union[dict, None]:
+        """Return the last session header with its latest contours as {wall: {frame: points}} and saved flag"""
+        session = None
+
+        try:
+            with open(path, "r") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn last line after a crash
+                        break
+
+                    if "session" in record:
+                        session = record
+                        session["contours"] = {wall: {} for wall in record.get("walls", [])}
+                        session["saved"] = False
+                    elif session is None:
+                        continue
+                    elif "wall" in record:
+                        session["contours"].setdefault(record["wall"], {})[record["frame"]] = record["points"]
+                        session["saved"] = False
+                    elif "saved" in record:
+                        session["saved"] = True
+        except OSError:
+            return None
+
+        return session
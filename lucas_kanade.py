@@ -1,10 +1,17 @@
+import os
 from typing import Union, List, Dict
+from time import perf_counter
 import numpy as np
 
 from PyQt5.QtCore import QThread, pyqtSignal, QPoint, QPointF, QObject
 from PyQt5.QtGui import QImage
 
 from qimage2ndarray import rgb_view
+from frames import FrameStack
+from config import get_param
+from results import ResultCache
+from smoothing import smooth
+import resources
 from skimage.color.colorconv import rgb2gray, rgba2rgb, rgb2hsv
 from skimage.transform import pyramid_gaussian
 
@@ -52,14 +59,22 @@ def _cart2pol(x, y, cent_x, cent_y, norm=2):
 
 
 def _area2cont(im_area):
+    area = np.pad(im_area != 0, 1)
+    inner = area[1:-1, 1:-1] & area[2:, 1:-1] & area[:-2, 1:-1] & area[1:-1, :-2] & area[1:-1, 2:]
     im_cont = im_area.copy()
-    y, x = np.where(im_cont != 0)
-    for i, j in zip(x, y):
-        if im_area[j + 1, i] != 0 and im_area[j - 1, i] != 0 and im_area[j, i - 1] != 0 and im_area[j, i + 1] != 0:
-            im_cont[j, i] = 0
+    im_cont[inner] = 0
     return im_cont
 
 
+def _coords2cont(cont_y, cont_x):
+    """Return cont_y, cont_x of the area boundary"""
+    top, left = cont_y.min(), cont_x.min()
+    area = np.zeros((cont_y.max() - top + 1, cont_x.max() - left + 1), dtype=bool)
+    area[cont_y - top, cont_x - left] = True
+    cont_y, cont_x = np.nonzero(_area2cont(area))
+    return cont_y + top, cont_x + left
+
+
 def _pol2cart(phi, rho, cent_x, cent_y):
     """Return x, y"""
     x = rho * np.cos(phi)
@@ -67,17 +82,16 @@ def _pol2cart(phi, rho, cent_x, cent_y):
     return x + cent_x, y + cent_y
 
 
-def _get_main_points(img):
+def _get_main_points(cont_y, cont_x, shape):
     """
     return apex_point, base_left_point, base_right_point
     """
-    cont_y, cont_x = np.where(img != 0)
     cent_x, cent_y = np.mean(cont_x), np.mean(cont_y)
 
     h = 1000
     w = 1000
-    k_w = w / img.shape[1]
-    k_h = h / img.shape[0]
+    k_w = w / shape[1]
+    k_h = h / shape[0]
 
     new_cont_x, new_cont_y = cont_x * k_w, cont_y * k_h
     cont_phi, cont_rho = _cart2pol(new_cont_x,
@@ -193,15 +207,17 @@ def _get_main_points(img):
 
 
 def _get_points(img, amount_points):
-    img_cont = _area2cont(img)
+    cont_y, cont_x = np.where(_area2cont(img) != 0)
+    return _get_contour_points(cont_y, cont_x, img.shape, amount_points)
+
 
+def _get_contour_points(cont_y, cont_x, shape, amount_points):
     h = 1000
     w = 1000
-    k_w = w / img_cont.shape[1]
-    k_h = h / img_cont.shape[0]
-    cont_y, cont_x = np.where(img_cont != 0)
+    k_w = w / shape[1]
+    k_h = h / shape[0]
 
-    top_point, base_l_point, base_r_point, orig_cent_x, orig_cent_y = _get_main_points(img_cont)
+    top_point, base_l_point, base_r_point, orig_cent_x, orig_cent_y = _get_main_points(cont_y, cont_x, shape)
 
     cont_x, cont_y = cont_x * k_w, cont_y * k_h
     cent_x, cent_y = np.mean(cont_x), np.mean(cont_y)
@@ -252,59 +268,94 @@ def _get_points(img, amount_points):
     return np.uint16(cont_x), np.uint16(cont_y), orig_cent_x, orig_cent_y
 
 
+class Profiler:
+    """Cumulative seconds and calls per stage, a no-op unless enabled"""
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.stages = {}
+
+    def start(self) -> float:
+        return perf_counter() if self.enabled else 0.0
+
+    def add(self, stage: str, start: float, calls: int = 1) -> None:
+        if self.enabled:
+            record = self.stages.setdefault(stage, [0.0, 0])
+            record[0] += perf_counter() - start
+            record[1] += calls
+
+    def report(self) -> dict:
+        return {stage: {"seconds": seconds, "calls": calls} for stage, (seconds, calls) in self.stages.items()}
+
+    def print(self) -> None:
+        total = sum(seconds for seconds, _ in self.stages.values()) or 1.0
+        for stage, (seconds, calls) in sorted(self.stages.items(), key=lambda item: -item[1][0]):
+            print(f"{stage:<12} {seconds * 1000:10.1f} ms {calls:>9} calls {seconds / total * 100:6.1f} %")
+
+
 class LucasKanade(QThread):
+    VERSION = 3
+    WINDOW = 61
+    LEVELS = 1
+    SLACK = 32
+    MIN_EIGENVALUE = 1e-5
+    FB_ERROR = 2.0
+    RESIDUAL = 3.0
+    SMOOTHNESS = 0.5
+    SPACING = 0.5
+
+    seeded = pyqtSignal(dict)
+    progress = pyqtSignal(dict)
     released = pyqtSignal(dict)
+    stats = pyqtSignal(dict)
 
     def __init__(self, amount_points: int, parent: QObject):
         super().__init__(parent)
 
         self.amount_points = amount_points
         self.contours = {}
-        self.files = []
-
-    def begin(self, contours: dict, files: list):
+        self.files = None
+        self.profiler = Profiler()
+        self.cache = None
+        self.resume = 1
+        self.smoothing = 0
+        self.order = 2
+        self.periodic = False
+        self.regularize = False
+        self.stop = False
+
+    def begin(self, contours: dict, files: FrameStack, resume: int = 1, cycle: bool = False):
+        """Track contours over files from pair resume; cycle tells that files span the whole recorded cycle"""
         self.contours = contours
         self.files = files
+        self.resume = resume
+        self.profiler = Profiler(get_param("profile_tracking") == "1")
+        self.smoothing = int(get_param("smooth_window"))
+        self.order = int(get_param("smooth_order"))
+        self.periodic = cycle and get_param("periodic_cycle") == "1"
+        self.regularize = get_param("regularize_contours") == "1"
+        self.stop = False
         self.start()
 
-    def win_image(self, img: np.ndarray, point: QPointF) -> np.ndarray:
-        win = 61
-        p1 = QPoint(round(point.x()) - win // 2, round(point.y()) - win // 2)
-        p2 = QPoint(round(point.x()) + win // 2 + 1, round(point.y()) + win // 2 + 1)
-
-        if p1.x() < 0:
-            p1.setX(0)
-        if p1.y() < 0:
-            p1.setY(0)
-        if p2.x() > img.shape[1]:
-            p2.setX(img.shape[1])
-        if p2.y() > img.shape[0]:
-            p2.setY(img.shape[0])
-
-        img: np.ndarray = img[p1.y():p2.y(), p1.x():p2.x()]
-
-        if img.shape[0] != win:
-            if p1.y() == 0:
-                img = np.concatenate((np.zeros((win - img.shape[0], img.shape[1])), img), axis=0)
-            elif p2.y() == img.shape[0]:
-                img = np.concatenate((img, np.zeros((win - img.shape[0], img.shape[1]))), axis=0)
-
-        if img.shape[1] != win:
-            if p1.x() == 0:
-                img = np.concatenate((np.zeros((img.shape[0], win - img.shape[1])), img), axis=1)
-            elif p2.x() == image.shape[1]:
-                img = np.concatenate((img, np.zeros((img.shape[0], win - img.shape[1]))), axis=1)
-
-        return img
-
     def sorted(self, contours: dict, data: dict) -> None:
+        profiler = self.profiler
         for wall, contour in self.contours.items():
-            if isinstance(contour, np.ndarray):
+            if isinstance(contour, np.ndarray) and contour.dtype == bool:
+                t = profiler.start()
                 x_s, y_s, *_ = _get_points(contour, self.amount_points)
+                profiler.add("seeding", t)
+                contours[wall] = [QPointF(x, y) for x, y in zip(x_s, y_s)]
+            elif isinstance(contour, np.ndarray):
+                t = profiler.start()
+                cont_y, cont_x = _coords2cont(contour[:, 0], contour[:, 1])
+                x_s, y_s, *_ = _get_contour_points(cont_y, cont_x, self.files.shape[1:], self.amount_points)
+                profiler.add("seeding", t)
                 contours[wall] = [QPointF(x, y) for x, y in zip(x_s, y_s)]
             elif isinstance(contour, str):
                 rang = (0.06, 0.07)
+                t = profiler.start()
                 cread = _imread(contour)
+                profiler.add("imread", t)
 
                 scale = np.array(np.where(np.all(cread == np.array([163, 73, 164]), axis=2))).T
                 try:
@@ -317,7 +368,9 @@ class LucasKanade(QThread):
                 hsvcont = rgb2hsv(cread[:, :, :3])
                 contour = (hsvcont[:, :, 0] > rang[0]) & (hsvcont[:, :, 0] < rang[1])
 
+                t = profiler.start()
                 x_s, y_s, *_ = _get_points(contour, self.amount_points)
+                profiler.add("seeding", t)
                 contours[wall] = [QPointF(x, y) for x, y in zip(x_s, y_s)]
             elif isinstance(contour, list) and isinstance(contour[0], list):
                 data[wall] = contour
@@ -325,6 +378,121 @@ class LucasKanade(QThread):
                 contours[wall] = contour
         self.contours = {}
 
+    def region(self, points: list, region: tuple = None) -> tuple:
+        """Return top, left, bottom, right around points with room for the coarsest window, aligned to the pyramid"""
+        height, width = self.files.shape[1:]
+        align = 2 ** self.LEVELS
+        margin = align * (self.WINDOW // 2 + 1) + self.SLACK
+
+        xs, ys = [p.x() for p in points], [p.y() for p in points]
+        top = max(int(min(ys)) - margin, 0) // align * align
+        left = max(int(min(xs)) - margin, 0) // align * align
+        bottom = min(-(-(int(max(ys)) + margin + 1) // align) * align, height)
+        right = min(-(-(int(max(xs)) + margin + 1) // align) * align, width)
+
+        if region is not None:
+            top, left = min(top, region[0]), min(left, region[1])
+            bottom, right = max(bottom, region[2]), max(right, region[3])
+
+        return top, left, bottom, right
+
+    def covers(self, region: tuple, points: list) -> bool:
+        """Whether the coarsest window around every point stays inside region, unless cut by the frame itself"""
+        height, width = self.files.shape[1:]
+        reach = 2 ** self.LEVELS * (self.WINDOW // 2 + 1)
+        top, left, bottom, right = region
+        return all((p.y() - reach >= top or top == 0) and (p.x() - reach >= left or left == 0) and
+                   (p.y() + reach < bottom or bottom == height) and (p.x() + reach < right or right == width)
+                   for p in points)
+
+    def solve(self, layers1: list, layers2: list, xs: np.ndarray, ys: np.ndarray) -> tuple:
+        """Return flow (N, 2) for all points at once and the smallest structure tensor eigenvalue per pixel"""
+        profiler = self.profiler
+        flow = np.zeros((len(xs), 2))
+        eigenvalue = np.zeros(len(xs))
+
+        for level, (layer1, layer2) in enumerate(zip(layers1[::-1], layers2[::-1])):
+            scale = 2 ** (self.LEVELS - level)
+
+            t = profiler.start()
+            win1 = _windows(layer1, xs / scale, ys / scale, self.WINDOW)
+            win2 = _windows(layer2, (xs + flow[:, 0]) / scale, (ys + flow[:, 1]) / scale, self.WINDOW)
+            profiler.add("windows", t, 2)
+
+            t = profiler.start()
+            fy, fx = np.gradient(win1, axis=(1, 2))
+            ft = win1 - win2
+            a, b, c = (fx * fx).sum(axis=(1, 2)), (fx * fy).sum(axis=(1, 2)), (fy * fy).sum(axis=(1, 2))
+            bx, by = (fx * ft).sum(axis=(1, 2)), (fy * ft).sum(axis=(1, 2))
+            profiler.add("gradient", t)
+
+            t = profiler.start()
+            det = a * c - b ** 2
+            eigenvalue = ((a + c) / 2 - np.sqrt(((a - c) / 2) ** 2 + b ** 2)) / self.WINDOW ** 2
+            # Ill-conditioned points keep the motion of the coarser level
+            solvable = eigenvalue >= self.MIN_EIGENVALUE
+            flow[:, 0] += np.divide(c * bx - b * by, det, out=np.zeros_like(det), where=solvable) * scale
+            flow[:, 1] += np.divide(a * by - b * bx, det, out=np.zeros_like(det), where=solvable) * scale
+            profiler.add("solve", t)
+
+        return flow, eigenvalue
+
+    def track(self, contour: list, layers1: list, layers2: list, region: tuple) -> tuple:
+        """Return tracked points and per point eigenvalue, residual, forward-backward error and reliable flag"""
+        profiler = self.profiler
+        top, left = region[:2]
+        xs = np.array([point.x() for point in contour]) - left
+        ys = np.array([point.y() for point in contour]) - top
+
+        flow, eigenvalue = self.solve(layers1, layers2, xs, ys)
+        moved = np.trunc(flow)
+        back, _ = self.solve(layers2, layers1, xs + moved[:, 0], ys + moved[:, 1])
+
+        t = profiler.start()
+        error = np.hypot(moved[:, 0] + back[:, 0], moved[:, 1] + back[:, 1])
+        residual = np.abs(_windows(layers1[0], xs, ys, self.WINDOW) -
+                          _windows(layers2[0], xs + moved[:, 0], ys + moved[:, 1], self.WINDOW)).mean(axis=(1, 2))
+        reliable = ((eigenvalue >= self.MIN_EIGENVALUE) & (error <= self.FB_ERROR) &
+                    (residual <= self.RESIDUAL * np.median(residual) + 1e-6))
+
+        # Unreliable points take the motion of their reliable neighbours along the contour
+        if reliable.any() and not reliable.all():
+            index = np.arange(len(contour))
+            for axis in range(2):
+                flow[~reliable, axis] = np.interp(index[~reliable], index[reliable], flow[reliable, axis])
+            moved = np.trunc(flow)
+        profiler.add("reliability", t)
+
+        if self.regularize:
+            t = profiler.start()
+            seed = np.column_stack((xs, ys))
+            flow = _regularize(seed + flow, seed, _anchors(len(contour)), self.SMOOTHNESS, self.SPACING) - seed
+            moved = np.trunc(flow)
+            profiler.add("regularize", t)
+
+        t = profiler.start()
+        points = [QPointF(point.x() + dx, point.y() + dy) for point, (dx, dy) in zip(contour, moved.tolist())]
+        profiler.add("qpointf", t)
+
+        return points, np.column_stack((eigenvalue, residual, error, reliable))
+
+    def postprocess(self, contours: list) -> list:
+        # Cycle closure applies on its own, smoothing only from a window of 3 frames
+        if self.smoothing < 3 and not self.periodic:
+            return contours
+        trajectory = np.array([[(point.x(), point.y()) for point in points] for points in contours])
+        trajectory = smooth(trajectory, self.smoothing, self.order, self.periodic)
+        return [[QPointF(x, y) for x, y in points] for points in trajectory.tolist()]
+
+    def cache_keys(self, contours: dict) -> dict:
+        digests = [self.files.digest(n) for n in range(len(self.files))]
+        parameters = self.VERSION, self.WINDOW, self.LEVELS, self.amount_points, self.regularize
+        return {type: ResultCache.key(parameters, digests, np.array([(p.x(), p.y()) for p in contour]))
+                for type, contour in contours.items()}
+
+    def cancel(self) -> None:
+        self.stop = True
+
     def run(self) -> None:
 
         contours, data = {}, {}
@@ -338,52 +506,285 @@ class LucasKanade(QThread):
             print("Set files and restart")
             return
 
+        profiler = self.profiler
+        keys = {}
+        if self.cache is not None and self.resume <= 1 and contours:
+            t = profiler.start()
+            keys = self.cache_keys(contours)
+            for type, key in keys.items():
+                result = self.cache.get(key)
+                if result is not None and len(result) == len(self.files):
+                    data[type] = self.postprocess([[QPointF(x, y) for x, y in points] for points in result])
+                    del contours[type]
+            profiler.add("cache", t)
+
+        reliability = {}
         for type, contour in contours.items():
+            data[type] = [contour]
+            reliability[type] = [np.column_stack((np.full(len(contour), np.inf), np.zeros((len(contour), 2)),
+                                                  np.ones(len(contour))))]
 
-            result = [contour]
-            files = iter(self.files)
+        self.seeded.emit({key: list(value) if isinstance(value, list) else value for key, value in data.items()})
 
-            im2read = _imread(next(files), as_gray=True)
+        resume = max(self.resume, 1)
+        total = len(self.files) - resume
+        start = perf_counter()
 
-            while True:
-                try:
-                    im1read = im2read
-                    im2read = _imread(next(files), as_gray=True)
-                except StopIteration:
-                    break
+        if contours:
+            region = self.region([point for contour in contours.values() for point in contour])
+
+            t = profiler.start()
+            im2read = self.files.gray(resume - 1, region)
+            profiler.add("read", t)
+
+            t = profiler.start()
+            layers2 = list(pyramid_gaussian(im2read, max_layer=self.LEVELS))
+            profiler.add("pyramid", t)
+
+        for n in range(resume, len(self.files) if contours else 0):
+
+            if self.stop:
+                break
+
+            layers1 = layers2
+            t = profiler.start()
+            im2read = self.files.gray(n, region)
+            profiler.add("read", t)
+
+            t = profiler.start()
+            layers2 = list(pyramid_gaussian(im2read, max_layer=self.LEVELS))
+            profiler.add("pyramid", t)
 
-                layers1 = list(pyramid_gaussian(im1read, max_layer=1))
-                layers2 = list(pyramid_gaussian(im2read, max_layer=1))
+            frame = {}
 
-                points = []
+            for type, contour in contours.items():
 
-                for point in contour:
-                    flow = np.array([[0], [0]])
-                    for n, (layer1, layer2) in enumerate(zip(layers1[::-1], layers2[::-1])):
-                        degree = 1 - n
+                if self.stop:
+                    break
 
-                        layer1 = self.win_image(layer1, QPointF(point.x() / 2 ** degree,
-                                                                point.y() / 2 ** degree))
-                        layer2 = self.win_image(layer2, QPointF((point.x() + flow[0]) / 2 ** degree,
-                                                                (point.y() + flow[1]) / 2 ** degree))
+                frame[type], scores = self.track(contour, layers1, layers2, region)
+                data[type].append(frame[type])
+                reliability[type].append(scores)
 
-                        fy, fx = np.gradient(layer1)
-                        ft = layer1 - layer2
-                        A = np.array([[np.sum(fx ** 2), np.sum(fx * fy)],
-                                      [np.sum(fx * fy), np.sum(fy ** 2)]])
-                        B = np.array([[np.sum(fx * ft)],
-                                      [np.sum(fy * ft)]])
+            if self.stop:
+                break
 
-                        solv_flow = np.linalg.lstsq(A, B, rcond=None)[0]
-                        flow = (flow + solv_flow) * 2
+            self.stats.emit({"done": n - resume + 1, "total": total, "elapsed": perf_counter() - start,
+                             "stages": profiler.report()})
 
-                    points.append(QPointF(point.x() + int(flow[0]), point.y() + int(flow[1])))
+            # Grow the crop before tracked points get close enough for their windows to reach its edge
+            moved = [point for points in frame.values() for point in points]
+            if not self.covers(region, moved):
+                region = self.region(moved, region)
+                t = profiler.start()
+                layers2 = list(pyramid_gaussian(self.files.gray(n, region), max_layer=self.LEVELS))
+                profiler.add("pyramid", t)
 
-                result.append(points)
+            self.progress.emit({"frame": n, "contours": frame,
+                                "reliability": {type: scores[-1] for type, scores in reliability.items()}})
 
-            data[type] = result
+        if profiler.enabled:
+            profiler.print()
 
         self.contours = {}
-        self.files = []
+        self.files = None
+        self.resume = 1
+
+        if self.stop:
+            return
 
+        for type in contours:
+            if type in keys:
+                self.cache.put(keys[type], np.array([[(point.x(), point.y()) for point in points]
+                                                     for points in data[type]], dtype=np.float32))
+
+        data["smoothed"] = []
+        if resume == 1 and (self.smoothing >= 3 or self.periodic):
+            t = profiler.start()
+            for type in contours:
+                data[type] = self.postprocess(data[type])
+                data["smoothed"].append(type)
+            profiler.add("smoothing", t)
+
+        # (frames, points, 4): eigenvalue, residual, forward-backward error, reliable
+        data["reliability"] = {type: np.array(scores) for type, scores in reliability.items()}
         self.released.emit(data)
+
+
+def _windows(layer: np.ndarray, xs: np.ndarray, ys: np.ndarray, size: int) -> np.ndarray:
+    """Return (N, size, size) windows centred on rounded xs, ys, zero outside the layer"""
+    height, width = layer.shape
+    offsets = np.arange(size) - size // 2
+    rows = np.rint(ys).astype(int)[:, None] + offsets
+    cols = np.rint(xs).astype(int)[:, None] + offsets
+    windows = layer[np.clip(rows, 0, height - 1)[:, :, None], np.clip(cols, 0, width - 1)[:, None, :]]
+    inside = ((rows >= 0) & (rows < height))[:, :, None] & ((cols >= 0) & (cols < width))[:, None, :]
+    return windows * inside
+
+
+def _anchors(amount_points: int) -> list:
+    """Indexes of the base points and, for odd amounts, the apex placed by _get_contour_points"""
+    anchors = {0, amount_points - 1}
+    if amount_points % 2:
+        anchors.add(amount_points // 2)
+    return sorted(anchors)
+
+
+def _regularize(points: np.ndarray, seed: np.ndarray, anchors: list, smoothness: float, spacing: float) -> np.ndarray:
+    """
+    Pull (N, 2) points towards the midpoint of their neighbours and towards the seed's spacing
+    between anchors, which stay where they were tracked
+    """
+    points = points.copy()
+    free = np.ones(len(points), dtype=bool)
+    free[anchors] = False
+
+    middle = (points[:-2] + points[2:]) / 2
+    points[1:-1] += smoothness * (middle - points[1:-1]) * free[1:-1, None]
+
+    for start, stop in zip(anchors[:-1], anchors[1:]):
+        segment, drawn = points[start:stop + 1], seed[start:stop + 1]
+        length = np.concatenate(([0], np.cumsum(np.hypot(*np.diff(segment, axis=0).T))))
+        drawn_length = np.concatenate(([0], np.cumsum(np.hypot(*np.diff(drawn, axis=0).T))))
+        if length[-1] == 0 or drawn_length[-1] == 0:
+            continue
+        target = drawn_length / drawn_length[-1] * length[-1]
+        resampled = np.column_stack((np.interp(target, length, segment[:, 0]),
+                                     np.interp(target, length, segment[:, 1])))
+        points[start + 1:stop] += spacing * (resampled[1:-1] - segment[1:-1])
+
+    return points
+
+
+def _trackable(contour) -> bool:
+    return not (isinstance(contour, list) and contour and isinstance(contour[0], list))
+
+
+class TrackingJob:
+    """Walls to track from their contours on frame start over frames[start:stop], beginning at pair resume"""
+
+    def __init__(self, contours: dict, frames: FrameStack, start: int = 0, stop: int = None, resume: int = 1):
+        self.contours = contours
+        self.frames = frames
+        self.start = start
+        self.stop = len(frames) if stop is None else stop
+        self.resume = resume
+        self.done = resume - 1
+        self.seeds = {}
+        self.cached = set()
+        self.cancelled = False
+
+    @property
+    def files(self) -> FrameStack:
+        return self.frames[self.start:self.stop]
+
+    def remainder(self, newer: "TrackingJob") -> list:
+        """Jobs for the frames this one has not tracked yet and newer does not cover"""
+        first = self.start + self.done + 1
+        groups = {}
+        for wall, contour in (self.seeds or self.contours).items():
+            # Walls served from the cache were seeded whole and smoothed, re-tracking would overwrite them raw
+            if wall in self.cached or not _trackable(contour):
+                continue
+            end = min(self.stop, newer.start) if wall in newer.contours else self.stop
+            if first < end:
+                groups.setdefault(end, {})[wall] = contour
+        return [TrackingJob(contours, self.frames, self.start, end, first - self.start)
+                for end, contours in groups.items()]
+
+
+class TrackingScheduler(QObject):
+    seeded = pyqtSignal(object, dict)
+    progress = pyqtSignal(object, dict)
+    released = pyqtSignal(object, dict)
+    stats = pyqtSignal(dict)
+    idle = pyqtSignal()
+
+    def __init__(self, amount_points: int, parent: QObject):
+        super().__init__(parent)
+
+        self.tracker = LucasKanade(amount_points, self)
+        size = int(get_param("result_cache_size_mb"))
+        if size > 0:
+            try:
+                self.tracker.cache = ResultCache(os.path.join(resources.ROOT, "cache"), size * 2 ** 20)
+            except OSError:
+                print("Result cache is off, its directory isn't writable")
+        self.tracker.seeded.connect(self._seeded)
+        self.tracker.progress.connect(self._progress)
+        self.tracker.released.connect(self._released)
+        self.tracker.stats.connect(self.stats)
+        self.tracker.finished.connect(self._next)
+
+        self.current = None
+        self.queue = []
+
+    def submit(self, job: TrackingJob) -> None:
+        """Run job ahead of everything else, keeping only the older work it does not redo"""
+        queue = [job]
+
+        if self.current is not None and not self.current.cancelled:
+            self.current.cancelled = True
+            self.tracker.cancel()
+            queue.extend(self.current.remainder(job))
+
+        for queued in self.queue:
+            queue.extend(queued.remainder(job))
+
+        self.queue = queue
+
+        if self.current is None:
+            self._next()
+
+    def enqueue(self, job: TrackingJob) -> None:
+        """Run job after everything already scheduled"""
+        self.queue.append(job)
+
+        if self.current is None:
+            self._next()
+
+    def cancel(self) -> None:
+        self.queue = []
+        if self.current is not None:
+            self.current.cancelled = True
+        self.tracker.cancel()
+
+    def wait(self) -> None:
+        self.tracker.wait()
+
+    def _next(self) -> None:
+        self.current = None
+
+        if not self.queue:
+            self.idle.emit()
+            return
+
+        self.current = self.queue.pop(0)
+        job = self.current
+        self.tracker.begin(job.contours, job.files, job.resume, job.start == 0 and job.stop == len(job.frames))
+
+    def _active(self) -> Union[TrackingJob, None]:
+        if self.current is None or self.current.cancelled:
+            return None
+        return self.current
+
+    def _seeded(self, data: dict) -> None:
+        job = self._active()
+        if job is None:
+            return
+        job.seeds = {wall: data[wall][0] for wall in job.contours
+                     if wall in data and _trackable(job.contours[wall])}
+        job.cached = {wall for wall in job.seeds if len(data[wall]) == len(job.files) > 1}
+        self.seeded.emit(job, data)
+
+    def _progress(self, frame: dict) -> None:
+        job = self._active()
+        if job is None:
+            return
+        job.done = frame["frame"]
+        self.progress.emit(job, frame)
+
+    def _released(self, data: dict) -> None:
+        job = self._active()
+        if job is not None:
+            self.released.emit(job, data)
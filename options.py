@@ -8,6 +8,8 @@ from PyQt5.QtCore import Qt, pyqtSignal
 from pathlib import Path
 from typing import Union
 
+import resources
+
 
 class FileList(QListWidgetItem):
     def __init__(self, path: str):
@@ -86,8 +88,7 @@ class Options(QDialog):
     def _setUI(self, data: dict) -> None:
         self.setObjectName("options")
 
-        with open("static/styles/options.css", "r") as style:
-            self.setStyleSheet(style.read())
+        self.setStyleSheet(resources.stylesheet("options"))
 
         layout = QVBoxLayout()
         layout.setAlignment(Qt.AlignCenter)
@@ -3,10 +3,13 @@ from PyQt5.QtCore import *
 from PyQt5.QtGui import *
 
 from typing import Literal, Union
-from qimage2ndarray import array2qimage, rgb_view
+from collections import OrderedDict
+from qimage2ndarray import rgb_view, raw_view
 import numpy as np
 
 from support import EntryLine, Utils, ToggleButton
+from frames import FrameStack
+import resources
 
 
 class Instruments(QGroupBox):
@@ -16,9 +19,6 @@ class Instruments(QGroupBox):
     def _setUI(self) -> None:
         self.setObjectName("instruments")
 
-        with open("static/styles/paint.css", "r") as style:
-            self.setStyleSheet(style.read())
-
         layout = QHBoxLayout()
         layout.setAlignment(Qt.AlignCenter)
         layout.setSpacing(10)
@@ -32,7 +32,7 @@ class Instruments(QGroupBox):
         button_group = QButtonGroup(self)
 
         brush = ToggleButton()
-        brush.setIcon(QIcon("static/images/brush.png"))
+        brush.setIcon(resources.icon("brush.png"))
         brush.setIconSize(QSize(42, 42))
         brush.setObjectName("brush")
         brush.toggle()
@@ -46,19 +46,19 @@ class Instruments(QGroupBox):
         width.setText("1")
 
         eraser = ToggleButton()
-        eraser.setIcon(QIcon("static/images/eraser.png"))
+        eraser.setIcon(resources.icon("eraser.png"))
         eraser.setIconSize(QSize(19, 19))
         eraser.setObjectName("eraser")
         button_group.addButton(eraser)
 
         dot_brush = ToggleButton()
-        dot_brush.setIcon(QIcon("static/images/dot_brush.png"))
+        dot_brush.setIcon(resources.icon("dot_brush.png"))
         dot_brush.setIconSize(QSize(18, 18))
         dot_brush.setObjectName("dot_brush")
         button_group.addButton(dot_brush)
 
         accept = QPushButton()
-        accept.setIcon(QIcon("static/images/accept.png"))
+        accept.setIcon(resources.icon("accept.png"))
         accept.setIconSize(QSize(22, 22))
         accept.setObjectName("accept")
         accept.setCursor(Qt.PointingHandCursor)
@@ -79,43 +79,79 @@ class Instruments(QGroupBox):
         self._setUI()
 
 
+class Stroke:
+    def __init__(self, mode: int, pen: QPen, point: QPoint):
+        self.mode = mode
+        self.pen = QPen(pen)
+        self.points = [point]
+
+    def add(self, point: QPoint) -> None:
+        self.points.append(point)
+
+    def draw(self, painter: QPainter) -> None:
+        painter.setPen(self.pen)
+        if self.mode == Canvas.ERASE:
+            painter.setCompositionMode(QPainter.CompositionMode_Clear)
+            for point in self.points:
+                painter.drawPoint(point)
+            painter.setCompositionMode(QPainter.CompositionMode_SourceOver)
+        else:
+            painter.drawPoint(self.points[0])
+            for begin, end in zip(self.points, self.points[1:]):
+                painter.drawLine(begin, end)
+
+
 class DiscolorPixmapItem(QGraphicsPixmapItem):
+    DISCOLOR = {
+        0xffff0000: 0xffb40000,
+        0xffffff00: 0xffb4b400,
+        0xffff00ff: 0xffb400b4
+    }
+    CACHE_SIZE = 4
 
-    def __init__(self, background: str):
-        pixels = rgb_view(QImage(background))
-        r, g, b = pixels[:, :, 0], pixels[:, :, 1], pixels[:, :, 2]
+    _cache = OrderedDict()
 
-        red_mask = (r == 255) & (g == 0) & (b == 0)
-        yellow_mask = (r == 255) & (g == 255) & (b == 0)
-        purple_mask = (r == 255) & (g == 0) & (b == 255)
+    @staticmethod
+    def discolor(frames: FrameStack) -> QImage:
+        key = frames.key(0)
+        cache = DiscolorPixmapItem._cache
 
-        pixels[red_mask] = np.array([180, 0, 0])
-        pixels[yellow_mask] = np.array([180, 180, 0])
-        pixels[purple_mask] = np.array([180, 0, 180])
+        if key in cache:
+            cache.move_to_end(key)
+            return cache[key]
 
-        pixmap = QPixmap.fromImage(array2qimage(pixels))
+        image = frames.image(0).convertToFormat(QImage.Format_RGB32)
+        pixels = raw_view(image)
+
+        keys = np.array(sorted(DiscolorPixmapItem.DISCOLOR), dtype=np.uint32)
+        values = np.array([DiscolorPixmapItem.DISCOLOR[key] for key in keys], dtype=np.uint32)
+
+        ys, xs = np.nonzero(np.isin(pixels, keys))
+        pixels[ys, xs] = values[np.searchsorted(keys, pixels[ys, xs])]
+
+        cache[key] = image
+        while len(cache) > DiscolorPixmapItem.CACHE_SIZE:
+            cache.popitem(last=False)
+
+        return image
+
+    def __init__(self, background: FrameStack):
+        pixmap = QPixmap.fromImage(DiscolorPixmapItem.discolor(background))
 
         super().__init__(pixmap)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
 
-        self._layer = QImage(self.pixmap().size(), QImage.Format_ARGB32)
+        self._layer = QImage(self.pixmap().size(), QImage.Format_ARGB32_Premultiplied)
+        self._layer.fill(Qt.transparent)
 
     def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget: QWidget) -> None:
         super().paint(painter, option, widget)
-        painter.drawImage(self._layer.rect(), self._layer)
+        rect = option.exposedRect.toAlignedRect() & self._layer.rect()
+        painter.drawImage(rect, self._layer, rect)
 
     def layer(self) -> QImage:
         return self._layer
 
-    def redraw(self) -> None:
-        super().setPixmap(self.pixmap())
-
-    def merge(self) -> QImage:
-        background = self.pixmap().toImage()
-        painter = QPainter(background)
-        painter.drawImage(background.rect(), self._layer)
-        painter.end()
-        return background
-
 
 class Canvas(QGraphicsView):
     ERASE = 0
@@ -124,8 +160,11 @@ class Canvas(QGraphicsView):
     RED = QColor(255, 0, 0)
     YELLOW = QColor(255, 255, 0)
     PURPLE = QColor(255, 0, 255)
+    CURSOR_CACHE_SIZE = 64
+
+    _cursors = OrderedDict()
 
-    def __init__(self, background: str):
+    def __init__(self, background: FrameStack):
         super().__init__()
 
         self.setScene(QGraphicsScene())
@@ -145,8 +184,17 @@ class Canvas(QGraphicsView):
         self.scene().addItem(graphic_pixmap)
 
         self.image = rgb_view(pixmap.toImage())
+        self.bright_table = np.zeros((self.image.shape[0] + 1, self.image.shape[1] + 1), dtype=np.int32)
+        self.bright_table[1:, 1:] = (self.image.sum(axis=2) > 3 * 222).cumsum(axis=0).cumsum(axis=1)
         self.mode = Canvas.LINE
         self.brush = QPen()
+        self.bright = False
+        self.cursor_key = None
+        self.strokes = []
+        self.undone = []
+        # Scale points and ready contours drawn before the user's strokes, kept out of undo
+        self.drawn = []
+        self.drawing = None
 
     def sizeHint(self) -> QSize:
         from math import ceil
@@ -170,36 +218,91 @@ class Canvas(QGraphicsView):
                 self.brush.setJoinStyle(Qt.BevelJoin)
         self.set_cursor()
 
+    def stroke_rect(self, start: QPointF, end: QPointF) -> QRectF:
+        margin = self.brush.width() + 2
+        return QRectF(start, end).normalized().adjusted(-margin, -margin, margin, margin)
+
     def draw_point(self, pos: QPointF) -> None:
         item = self.scene().items()[0]
         layer = item.layer()
-        painter = QPainter(layer)
-        painter.setPen(self.brush)
         transform_pos = self.mapToScene(pos)
-        if self.mode == Canvas.ERASE:
-            painter.setCompositionMode(QPainter.CompositionMode_Clear)
-        painter.drawPoint(QPoint(transform_pos.x(), transform_pos.y()))
+        stroke = Stroke(self.mode, self.brush, transform_pos.toPoint())
+        self.strokes.append(stroke)
+        self.drawing = stroke
+        self.undone.clear()
+        painter = QPainter(layer)
+        stroke.draw(painter)
         painter.end()
-        item.redraw()
+        item.update(self.stroke_rect(transform_pos, transform_pos))
         self.prev_pos = pos
 
     def draw_line(self, pos: QPointF) -> None:
+        # Undo or redo in the middle of a drag ends its stroke
+        if self.drawing is None:
+            return
+
         item = self.scene().items()[0]
         layer = item.layer()
         painter = QPainter(layer)
         painter.setPen(self.brush)
         transform_pos = self.mapToScene(pos)
         transform_prev_pos = self.mapToScene(self.prev_pos)
+        self.drawing.add(transform_pos.toPoint())
         if self.mode == Canvas.ERASE:
             painter.setCompositionMode(QPainter.CompositionMode_Clear)
-            painter.drawPoint(QPoint(transform_pos.x(), transform_pos.y()))
+            painter.drawPoint(transform_pos.toPoint())
         else:
-            painter.drawLine(QPoint(transform_prev_pos.x(), transform_prev_pos.y()),
-                             QPoint(transform_pos.x(), transform_pos.y()))
+            painter.drawLine(transform_prev_pos.toPoint(), transform_pos.toPoint())
         painter.end()
-        item.redraw()
+        if self.mode == Canvas.ERASE:
+            item.update(self.stroke_rect(transform_pos, transform_pos))
+        else:
+            item.update(self.stroke_rect(transform_prev_pos, transform_pos))
         self.prev_pos = pos
 
+    def undo(self) -> None:
+        if not self.strokes:
+            return
+
+        self.undone.append(self.strokes.pop())
+        self.drawing = None
+
+        item = self.scene().items()[0]
+        layer = item.layer()
+        layer.fill(Qt.transparent)
+        painter = QPainter(layer)
+        for stroke in self.strokes:
+            stroke.draw(painter)
+        painter.end()
+        item.update()
+
+    def redo(self) -> None:
+        if not self.undone:
+            return
+
+        stroke = self.undone.pop()
+        self.strokes.append(stroke)
+        self.drawing = None
+
+        item = self.scene().items()[0]
+        painter = QPainter(item.layer())
+        stroke.draw(painter)
+        painter.end()
+        item.update()
+
+    def rasterize(self) -> QImage:
+        layer = QImage(self.scene().items()[0].layer().size(), QImage.Format_ARGB32_Premultiplied)
+        layer.fill(Qt.transparent)
+        painter = QPainter(layer)
+        for stroke in self.strokes:
+            stroke.draw(painter)
+        # Pre-drawn items sit on the background, under the strokes and out of the eraser's reach
+        painter.setCompositionMode(QPainter.CompositionMode_DestinationOver)
+        for stroke in self.drawn:
+            stroke.draw(painter)
+        painter.end()
+        return layer
+
     def scroll(self, pos: QPoint) -> None:
         offset = self.prev_pos - pos
         self.verticalScrollBar().setValue(self.verticalScrollBar().value() + offset.y())
@@ -214,6 +317,7 @@ class Canvas(QGraphicsView):
         painter.drawPoint(pos)
         painter.end()
         item.setPixmap(pixmap)
+        self.drawn.append(Stroke(Canvas.POINT, self.brush, pos))
 
     def draw_contour(self, points: list) -> None:
         item = self.scene().items()[0]
@@ -238,6 +342,11 @@ class Canvas(QGraphicsView):
 
         item.setPixmap(pixmap)
 
+        stroke = Stroke(Canvas.LINE, self.brush, points[0])
+        for point in points[1:]:
+            stroke.add(point)
+        self.drawn.append(stroke)
+
     def wheelEvent(self, event: QWheelEvent):
         delta = event.angleDelta().y()
 
@@ -282,18 +391,15 @@ class Canvas(QGraphicsView):
         if event.buttons() & Qt.RightButton:
             self.scroll(event.pos())
 
-        # if self.background_bright(event.pos()):
-        #     self.cursor_brush.setColor(Qt.black)
-        # else:
-        #     self.cursor_brush.setColor(Qt.white)
-        #
-        # self.set_cursor()
+        bright = self.background_bright(event.pos())
+        if bright != self.bright:
+            self.bright = bright
+            self.set_cursor()
 
         super().mouseMoveEvent(event)
 
     def background_bright(self, pos: QPointF) -> bool:
-        transform_pos = self.mapToScene(pos)
-        pos = QPoint(transform_pos.x(), transform_pos.y())
+        pos = self.mapToScene(pos).toPoint()
 
         cursor_width = int(self.cursor().pixmap().width() / self.transform().m11())
         radius = cursor_width // 2
@@ -316,31 +422,36 @@ class Canvas(QGraphicsView):
         if bottom_pixel > self.image.shape[0]:
             bottom_pixel = self.image.shape[0]
 
-        frame = self.image[top_pixel:bottom_pixel, left_pixel:right_pixel, :]
-        light_pixels = np.count_nonzero(frame.sum(axis=2) / 3 > 222)
-        all_pixels = frame.shape[0] * frame.shape[1]
+        table = self.bright_table
+        light_pixels = (table[bottom_pixel, right_pixel] - table[top_pixel, right_pixel]
+                        - table[bottom_pixel, left_pixel] + table[top_pixel, left_pixel])
+        all_pixels = (bottom_pixel - top_pixel) * (right_pixel - left_pixel)
 
-        try:
-            return light_pixels / all_pixels > 0.5
-        except ZeroDivisionError:
+        if all_pixels <= 0:
             return True
 
-    def set_cursor(self) -> None:
+        return light_pixels / all_pixels > 0.5
 
-        if self.mode != Canvas.POINT:
-            size = QSize(1, 1) * self.brush.width() * self.transform().m11()
-        else:
-            size = QSize(1, 1)
+    @staticmethod
+    def brush_cursor(mode: int, width: int, bright: bool = False) -> QCursor:
+        key = mode, width, bright
+        cursors = Canvas._cursors
 
-        tr_black = 170
-        tr_white = 255
+        if key in cursors:
+            cursors.move_to_end(key)
+            return cursors[key]
+
+        size = QSize(width, width)
+
+        dark = QColor(255, 255, 255, 170) if bright else QColor(0, 0, 0, 170)
+        light = QColor(0, 0, 0, 255) if bright else QColor(255, 255, 255, 255)
 
         if size.width() < 5:
             cursor = QPixmap(QSize(19, 19))
             cursor.fill(Qt.transparent)
 
             painter = QPainter(cursor)
-            painter.setPen(QPen(QColor(0, 0, 0, tr_black), 1))
+            painter.setPen(QPen(dark, 1))
 
             radius = size.width() // 2
             dist = 5
@@ -356,24 +467,24 @@ class Canvas(QGraphicsView):
             painter.drawLine(center.x() + 1, center.y() + dist, center.x() + 1, rect.height() - 1)
             painter.drawLine(center.x() - 1, center.y() + dist, center.x() - 1, rect.height() - 1)
 
-            painter.setPen(QPen(QColor(255, 255, 255, tr_white), 1))
+            painter.setPen(QPen(light, 1))
             painter.drawLine(rect.x(), center.y(), center.x() - dist, center.y())
             painter.drawLine(center.x() + dist, center.y(), rect.width() - 1, center.y())
             painter.drawLine(center.x(), rect.y(), center.x(), center.y() - dist)
             painter.drawLine(center.x(), center.y() + dist, center.x(), rect.height() - 1)
 
             if size.width() > 1:
-                if self.mode == Canvas.LINE:
-                    painter.setPen(QPen(QColor(0, 0, 0, tr_black), 3))
+                if mode == Canvas.LINE:
+                    painter.setPen(QPen(dark, 3))
                     painter.drawPoint(center.x(), center.y())
-                    painter.setPen(QPen(QColor(255, 255, 255, tr_white), 1))
+                    painter.setPen(QPen(light, 1))
                     painter.drawEllipse(center.x() - radius, center.y() - radius, radius * 2, radius * 2)
-                elif self.mode == Canvas.ERASE:
+                elif mode == Canvas.ERASE:
                     painter.drawRect(center.x() - radius, center.y() - radius, radius * 2, radius * 2)
             else:
-                painter.setPen(QPen(QColor(0, 0, 0, tr_black), 3))
+                painter.setPen(QPen(dark, 3))
                 painter.drawPoint(center.x(), center.y())
-                painter.setPen(QPen(QColor(255, 255, 255, tr_white), 1))
+                painter.setPen(QPen(light, 1))
                 painter.drawPoint(center.x(), center.y())
 
             painter.end()
@@ -381,35 +492,53 @@ class Canvas(QGraphicsView):
             cursor = QPixmap(QSize(size.width() + 3 + 1, size.height() + 3 + 1))
             cursor.fill(Qt.transparent)
             painter = QPainter(cursor)
-            painter.setPen(QPen(QColor(0, 0, 0, tr_black), 1))
+            painter.setPen(QPen(dark, 1))
             center = cursor.rect().center() + QPoint(1, 1)
-            if self.mode == Canvas.LINE:
+            if mode == Canvas.LINE:
                 painter.setRenderHint(QPainter.Antialiasing)
                 painter.drawEllipse(center.x() - size.width() / 2, center.y() - size.height() / 2,
                                     size.width(), size.height())
-                painter.setPen(QPen(QColor(255, 255, 255, tr_white), 1))
+                painter.setPen(QPen(light, 1))
                 painter.drawEllipse(center.x() - size.width() / 2 + 1, center.y() - size.height() / 2 + 1,
                                     size.width() - 2, size.height() - 2)
-            elif self.mode == Canvas.ERASE:
+            elif mode == Canvas.ERASE:
                 painter.drawRect(center.x() - size.width() / 2, center.y() - size.height() / 2,
                                  size.width(), size.height())
-                painter.setPen(QPen(QColor(255, 255, 255, tr_white), 1))
+                painter.setPen(QPen(light, 1))
                 painter.drawRect(center.x() - size.width() / 2 + 1, center.y() - size.height() / 2 + 1,
                                  size.width() - 2, size.height() - 2)
             painter.end()
 
-        super().setCursor(QCursor(cursor))
+        cursors[key] = QCursor(cursor)
+        while len(cursors) > Canvas.CURSOR_CACHE_SIZE:
+            cursors.popitem(last=False)
+
+        return cursors[key]
+
+    def set_cursor(self) -> None:
+
+        if self.mode != Canvas.POINT:
+            width = (QSize(1, 1) * self.brush.width() * self.transform().m11()).width()
+        else:
+            width = 1
+
+        key = self.mode, width, self.bright
+
+        if key == self.cursor_key:
+            return
+
+        self.cursor_key = key
+        super().setCursor(Canvas.brush_cursor(*key))
 
 
 class Paint(QDialog):
     READY_ENDO = 1
     READY_EPI = 2
 
-    def _setUI(self, background: str) -> None:
+    def _setUI(self, background: FrameStack) -> None:
         self.setObjectName("paint")
 
-        with open("static/styles/paint.css", "r") as style:
-            self.setStyleSheet(style.read())
+        self.setStyleSheet(resources.stylesheet("paint"))
 
         layout = QVBoxLayout()
         layout.setContentsMargins(0, 10, 0, 0)
@@ -425,17 +554,15 @@ class Paint(QDialog):
         Utils.move_center_hint(self)
 
     def __init__(self,
-                 background: str,
+                 background: FrameStack,
                  type: int = None,
                  contour: list = None,
                  scale_start: QPointF = None,
-                 scale_end: QPointF = None):
+                 scale_end: QPointF = None,
+                 title: str = ""):
         super().__init__()
 
-        from os.path import basename, dirname
-
-        dir = basename(dirname(background))
-        self.setWindowTitle(dir)
+        self.setWindowTitle(title)
 
         self.setModal(True)
         self.setWindowFlag(Qt.WindowContextHelpButtonHint, False)
@@ -453,7 +580,7 @@ class Paint(QDialog):
 
         if scale_start is not None and scale_end is not None:
             dot_brush.setEnabled(False)
-            dot_brush.setIcon(QIcon("static/images/dot_brush_disabled.png"))
+            dot_brush.setIcon(resources.icon("dot_brush_disabled.png"))
             dot_brush.setIconSize(QSize(28, 28))
 
         if scale_start is not None:
@@ -486,6 +613,9 @@ class Paint(QDialog):
         width.textEdited.connect(self.change_width)
         accept.clicked.connect(self.accept)
 
+        QShortcut(QKeySequence.Undo, self, canvas.undo)
+        QShortcut(QKeySequence.Redo, self, canvas.redo)
+
         self.showMaximized()
 
     def change_type_brush(self, type: int) -> None:
@@ -542,30 +672,27 @@ class Paint(QDialog):
             return done
 
         canvas: Canvas = self.findChild(Canvas)
-        image: np.ndarray = rgb_view(canvas.scene().items()[0].merge())
+        layer = canvas.rasterize()
+        pixels: np.ndarray = raw_view(layer)
 
-        contours = {
-            "endo": np.all(image == (255, 0, 0), axis=-1),
-            "epi": np.all(image == (255, 255, 0), axis=-1),
-            "scale": np.array(np.where(np.all(image == np.array([255, 0, 255]), axis=2))).T
-        }
+        ys, xs = np.nonzero(pixels)
+        colors = pixels[ys, xs]
 
-        endo_exist = np.any(contours["endo"])
-        epi_exist = np.any(contours["epi"])
-
-        try:
-            contours["scale_start"] = QPoint(contours.get("scale")[0][1], contours.get("scale")[0][0])
-            contours["scale_end"] = QPoint(contours.get("scale")[1][1], contours.get("scale")[1][0])
-        except IndexError:
-            contours["scale_start"] = QPoint(-1, -1)
-            contours["scale_end"] = QPoint(-1, -1)
+        contours = {}
 
-        del contours["scale"]
+        for wall, color in (("endo", Canvas.RED), ("epi", Canvas.YELLOW)):
+            hit = colors == color.rgba()
+            if np.any(hit):
+                contours[wall] = np.stack((ys[hit], xs[hit]), axis=1)
 
-        if not endo_exist:
-            del contours["endo"]
+        scale = colors == Canvas.PURPLE.rgba()
+        scale_y, scale_x = ys[scale], xs[scale]
 
-        if not epi_exist:
-            del contours["epi"]
+        if len(scale_y) > 1:
+            contours["scale_start"] = QPoint(int(scale_x[0]), int(scale_y[0]))
+            contours["scale_end"] = QPoint(int(scale_x[1]), int(scale_y[1]))
+        else:
+            contours["scale_start"] = QPoint(-1, -1)
+            contours["scale_end"] = QPoint(-1, -1)
 
         return contours
@@ -0,0 +1,45 @@
+import numpy as np
+
+
+def shoelace(contours: np.ndarray) -> np.ndarray:
+    """Area of (..., points, 2) contours closed by the chord between their ends"""
+    x, y = contours[..., 0], contours[..., 1]
+    return np.abs(np.sum(x * np.roll(y, -1, axis=-1) - np.roll(x, -1, axis=-1) * y, axis=-1)) / 2
+
+
+def length(contours: np.ndarray) -> np.ndarray:
+    return np.linalg.norm(np.diff(contours, axis=-2), axis=-1).sum(axis=-1)
+
+
+def end_phases(area: np.ndarray, length: np.ndarray) -> tuple:
+    """Return end-systole and end-diastole frames: the smallest and the largest area, ties broken by length"""
+    known = np.flatnonzero(~np.isnan(area))
+    if not len(known):
+        return -1, -1
+    area, length = area[known], length[known]
+    return int(known[np.lexsort((length, area))[0]]), int(known[np.lexsort((-length, -area))[0]])
+
+
+class CardiacPhases:
+    """Per frame area and length of a wall, updated one frame at a time as contours are tracked or edited"""
+
+    WALLS = "endo", "epi"
+
+    def __init__(self, frames: int):
+        self.area = {wall: np.full(frames, np.nan) for wall in self.WALLS}
+        self.length = {wall: np.full(frames, np.nan) for wall in self.WALLS}
+
+    def set(self, wall: str, contours: list, start: int = 0) -> None:
+        if wall not in self.area or not contours:
+            return
+        stop = min(start + len(contours), len(self.area[wall]))
+        points = np.array([[(p.x(), p.y()) for p in contour] for contour in contours[:stop - start]], dtype=float)
+        self.area[wall][start:stop] = shoelace(points)
+        self.length[wall][start:stop] = length(points)
+
+    def detect(self) -> tuple:
+        """End-systole and end-diastole frames of the cavity (endo), or of epi when there is no endo"""
+        for wall in self.WALLS:
+            if not np.isnan(self.area[wall]).all():
+                return end_phases(self.area[wall], self.length[wall])
+        return -1, -1
@@ -0,0 +1,22 @@
+import os
+from functools import lru_cache
+
+from PyQt5.QtGui import QIcon
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def path(*parts: str) -> str:
+    return os.path.join(ROOT, "static", *parts)
+
+
+@lru_cache(maxsize=None)
+def stylesheet(name: str) -> str:
+    with open(path("styles", f"{name}.css"), "r") as style:
+        root = ROOT.replace(os.sep, "/")
+        return style.read().replace('url("static/', f'url("{root}/static/')
+
+
+@lru_cache(maxsize=None)
+def icon(name: str) -> QIcon:
+    return QIcon(path("images", name))
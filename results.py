@@ -0,0 +1,71 @@
+import os
+import hashlib
+from threading import Lock
+from typing import Union
+
+import numpy as np
+
+
+class ResultCache:
+    """Tracked contours on disk as (frames, points, 2) arrays, least recently used evicted over limit bytes"""
+
+    def __init__(self, dir: str, limit: int):
+        self.dir = dir
+        self.limit = limit
+        self._lock = Lock()
+
+        os.makedirs(dir, exist_ok=True)
+
+    @staticmethod
+    def key(*parts) -> str:
+        digest = hashlib.blake2b(digest_size=20)
+        for part in parts:
+            if isinstance(part, np.ndarray):
+                digest.update(f"{part.dtype}{part.shape}".encode())
+                digest.update(np.ascontiguousarray(part).tobytes())
+            else:
+                digest.update(repr(part).encode())
+        return digest.hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.dir, f"{key}.npy")
+
+    def get(self, key: str) -> Union[np.ndarray, None]:
+        path = self._path(key)
+        try:
+            array = np.load(path)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return array
+
+    def put(self, key: str, array: np.ndarray) -> None:
+        path = self._path(key)
+        temp = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temp, "wb") as file:
+                np.save(file, array)
+            os.replace(temp, path)
+        except OSError:
+            print("Tracking result wasn't cached")
+            return
+        self.evict()
+
+    def evict(self) -> None:
+        with self._lock:
+            entries = []
+            with os.scandir(self.dir) as files:
+                for entry in files:
+                    if entry.name.endswith(".npy"):
+                        stat = entry.stat()
+                        entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.limit:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
@@ -0,0 +1,38 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def savgol_coefficients(window: int, order: int) -> np.ndarray:
+    half = window // 2
+    return np.linalg.pinv(np.vander(np.arange(-half, half + 1), order + 1, increasing=True))[0]
+
+
+def close_cycle(trajectory: np.ndarray) -> np.ndarray:
+    """Spread the drift of the last frame linearly over the sequence so the cycle ends where it started"""
+    ramp = np.linspace(0, 1, len(trajectory))[:, None, None]
+    return trajectory - ramp * (trajectory[-1] - trajectory[0])
+
+
+def smooth(trajectory: np.ndarray, window: int, order: int = 2, periodic: bool = False) -> np.ndarray:
+    """Return Savitzky-Golay smoothed (frames, points, 2) trajectory with the first frame kept as drawn"""
+    if periodic:
+        trajectory = close_cycle(trajectory)
+
+    # Even windows are rounded up, the coefficients are centred on an odd number of frames
+    frames = len(trajectory)
+    window = min(window | 1, frames - 1 + frames % 2)
+    if window < 3 or window <= order:
+        return trajectory
+
+    half = window // 2
+    if periodic:
+        padded = np.concatenate((trajectory[-half - 1:-1], trajectory, trajectory[1:half + 1]))
+    else:
+        padded = np.pad(trajectory, ((half, half), (0, 0), (0, 0)), mode="reflect")
+
+    smoothed = sliding_window_view(padded, window, axis=0) @ savgol_coefficients(window, order)
+    smoothed[0] = trajectory[0]
+    if periodic:
+        smoothed[-1] = trajectory[0]
+
+    return smoothed
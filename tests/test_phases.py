@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from phases import shoelace, length, end_phases, CardiacPhases
+
+
+class Point:
+    def __init__(self, x, y):
+        self._x, self._y = x, y
+
+    def x(self):
+        return self._x
+
+    def y(self):
+        return self._y
+
+
+def square(side):
+    return [Point(0, 0), Point(side, 0), Point(side, side), Point(0, side)]
+
+
+def test_shoelace_and_length():
+    contours = np.array([[(0, 0), (4, 0), (4, 3), (0, 3)]], dtype=float)
+
+    assert np.allclose(shoelace(contours), [12])
+    assert np.allclose(length(contours), [10])
+
+
+def test_end_phases_skip_untracked_frames_and_break_ties_by_length():
+    area = np.array([np.nan, 4.0, 1.0, 1.0, 9.0])
+    perimeter = np.array([np.nan, 8.0, 5.0, 4.0, 12.0])
+
+    assert end_phases(area, perimeter) == (3, 4)
+    assert end_phases(np.full(3, np.nan), np.full(3, np.nan)) == (-1, -1)
+
+
+def test_cardiac_phases_prefer_endo_and_update_single_frames():
+    phases = CardiacPhases(4)
+    phases.set("epi", [square(5), square(1), square(9), square(3)])
+    assert phases.detect() == (1, 2)
+
+    phases.set("endo", [square(4), square(2), square(3)])
+    assert phases.detect() == (1, 0)
+
+    phases.set("endo", [square(1)], 2)
+    assert phases.detect() == (2, 0)
+
+
+def test_workspace_writes_sys_id_as_study_frame_number():
+    pytest.importorskip("PyQt5")
+    from workspace import Workspace
+
+    phases = CardiacPhases(3)
+    phases.set("endo", [square(4), square(2), square(3)])
+    data = {"frames": SimpleNamespace(indexes=range(0, 9, 3)), "sys_id": -1}
+    workspace = SimpleNamespace(detecting=True, phases=phases, widget=lambda index: SimpleNamespace(data=data))
+
+    Workspace.detect_phases(workspace)
+
+    assert data == {"frames": data["frames"], "sys_id": 4}
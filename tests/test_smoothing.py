@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+from smoothing import smooth
+
+
+@pytest.mark.parametrize("window", [3, 4, 5, 6])
+def test_smooth_odd_and_even_windows(window):
+    rng = np.random.default_rng(0)
+    trajectory = rng.random((12, 5, 2))
+
+    smoothed = smooth(trajectory, window)
+
+    assert smoothed.shape == trajectory.shape
+    assert np.array_equal(smoothed[0], trajectory[0])
+
+
+def test_even_window_rounds_up():
+    trajectory = np.random.default_rng(1).random((12, 5, 2))
+    assert np.allclose(smooth(trajectory, 4), smooth(trajectory, 5))
+
+
+def test_periodic_closes_cycle_without_smoothing():
+    trajectory = np.cumsum(np.ones((8, 3, 2)), axis=0)
+
+    closed = smooth(trajectory, 0, periodic=True)
+
+    assert np.allclose(closed[-1], trajectory[0])
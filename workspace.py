@@ -7,7 +7,12 @@ from PyQt5.QtGui import *
 
 from support import (EntryLine, EntryLinePostfix, IntValid,
                      GraphicLine, GraphicPoint, AddGraphicLine, AddGraphicPoint, Utils)
-from lucas_kanade import LucasKanade
+from lucas_kanade import TrackingJob, TrackingScheduler
+from journal import Journal
+from dense_flow import DenseFlow
+from phases import CardiacPhases
+from config import get_param
+import resources
 
 
 class DialogProgress(QDialog):
@@ -66,7 +71,7 @@ class SaveContoursFrames(QThread):
             if self.stop:
                 break
 
-            frame = Image.open(frame)
+            frame = Image.fromarray(frame)
             draw = ImageDraw.Draw(frame)
             for type in self.types:
                 fill = (255, 0, 0) if type == "endo" else (255, 255, 0)
@@ -84,6 +89,8 @@ class SaveContoursFrames(QThread):
 
 
 class Menu(QGroupBox):
+    saved = pyqtSignal()
+
     def _setUI(self, dir_name: str, parent: QWidget) -> None:
         self.setObjectName("menu")
 
@@ -99,7 +106,7 @@ class Menu(QGroupBox):
 
         save_imgs = QPushButton()
         save_imgs.setObjectName("save_imgs")
-        save_imgs.setIcon(QIcon("static/images/save_imgs_arrow.png"))
+        save_imgs.setIcon(resources.icon("save_imgs_arrow.png"))
         save_imgs.setIconSize(QSize(35, 35))
         save_imgs.setCursor(Qt.PointingHandCursor)
 
@@ -129,12 +136,20 @@ class Menu(QGroupBox):
 
         save_data = QPushButton()
         save_data.setObjectName("save_data")
-        save_data.setIcon(QIcon("static/images/save_data.png"))
+        save_data.setIcon(resources.icon("save_data.png"))
         save_data.setIconSize(QSize(20, 20))
         save_data.setCursor(Qt.PointingHandCursor)
         save_data.setToolTip("Save data")
         save_data.clicked.connect(self.save_data)
 
+        save_flow = QPushButton("Flow")
+        save_flow.setObjectName("save_flow")
+        save_flow.setCursor(Qt.PointingHandCursor)
+        save_flow.setToolTip("Save dense myocardial flow")
+        save_flow.clicked.connect(self.save_flow)
+        if not (endo_exist and epi_exist):
+            save_flow.hide()
+
         type_points = QComboBox()
         type_points.setObjectName("type_points")
         type_points_list = QListView()
@@ -156,6 +171,7 @@ class Menu(QGroupBox):
 
         layout.addWidget(save_imgs)
         layout.addWidget(save_data)
+        layout.addWidget(save_flow)
         layout.addWidget(title_file, alignment=Qt.AlignLeft)
         layout.addWidget(type_points)
         layout.addWidget(entry_float_values, alignment=Qt.AlignLeft)
@@ -174,9 +190,15 @@ class Menu(QGroupBox):
             lambda: self.progess.findChild(QPushButton, "accept").setEnabled(True))
         self.saveContoursFrames.progress.connect(
             lambda value: save_bar.setValue(value))
-        self.dir = os.path.dirname(data.get("frames")[0])
+        self.denseFlow = DenseFlow(self)
+        self.progess.rejected.connect(lambda: setattr(self.denseFlow, "stop", True))
+        self.denseFlow.finished.connect(
+            lambda: self.progess.findChild(QPushButton, "accept").setEnabled(True))
+        self.denseFlow.progress.connect(
+            lambda value: save_bar.setValue(value))
+        self.dir = data.get("dir")
 
-        self._setUI(os.path.basename(self.dir), parent)
+        self._setUI(data.get("title"), parent)
 
     def save_data(self) -> None:
 
@@ -272,6 +294,26 @@ class Menu(QGroupBox):
         self.progess.clearFocus()
         self.progess.exec_()
 
+    def save_flow(self) -> None:
+
+        title_file = self.findChild(EntryLine, 'title_file').text().strip()
+
+        if not title_file:
+            msg = QMessageBox()
+            msg.setText("File name is empty")
+            return msg.exec_()
+
+        path = os.path.join(self.dir, f"{title_file}_flow.npy")
+
+        self.progess.setWindowTitle("Dense flow")
+        save_bar: QProgressBar = self.progess.findChild(QProgressBar)
+        save_bar.setRange(0, len(self.data["frames"]) - 2)
+        save_bar.reset()
+        accept = self.progess.findChild(QPushButton, "accept")
+        accept.setEnabled(False)
+        self.denseFlow.begin(self.data["frames"], self.data["ready_contours"], path)
+        self.progess.clearFocus()
+        self.progess.exec_()
 
     def file_data(self, path: str) -> None:
 
@@ -301,6 +343,8 @@ class Menu(QGroupBox):
                     points[-1] = f"{points[-1].rstrip()}\n"
                     file.writelines(points)
 
+        self.saved.emit()
+
 
 class WallTypes(QGroupBox):
     ENDO = 1
@@ -314,15 +358,15 @@ class WallTypes(QGroupBox):
         self.setObjectName("walltypes")
         layout = QHBoxLayout()
 
-        binding = QIcon("static/images/binding.png")
-        binding_enable = QIcon("static/images/binding_enable2.png")
+        binding = resources.icon("binding.png")
+        binding_enable = resources.icon("binding_enable2.png")
 
         if WallTypes.BOTH == type:
             group = QButtonGroup(self)
             connect = QPushButton()
             connect.setObjectName("connect_button")
             connect.setCheckable(True)
-            connect.setIcon(QIcon("static/images/binding.png"))
+            connect.setIcon(resources.icon("binding.png"))
             connect.setChecked(False)
             connect.setCursor(Qt.PointingHandCursor)
             connect.setIconSize(QSize(48, 48))
@@ -368,10 +412,13 @@ class WallTypes(QGroupBox):
 
 
 class Picture(QGraphicsView):
+    edited = pyqtSignal()
 
-    def __init__(self, background: str = None):
+    def __init__(self, background: QImage = None):
         super().__init__()
 
+        self.moving = False
+
         self.setScene(QGraphicsScene())
         self.setRenderHint(QPainter.Antialiasing)
         self.setTransformationAnchor(QGraphicsView.AnchorUnderMouse)
@@ -379,7 +426,7 @@ class Picture(QGraphicsView):
         self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
         self.setFrameStyle(False)
 
-        pixmap = QPixmap(background)
+        pixmap = QPixmap.fromImage(background)
         graphic_pixmap = QGraphicsPixmapItem(pixmap)
 
         self.scale_value = Utils.get_scale_value(pixmap.size() + QSize(0, 350))
@@ -399,10 +446,10 @@ class Picture(QGraphicsView):
         self._radius = slider
         self._radius.valueChanged.connect(self.change_radius)
 
-    def set_picture(self, background: str, points: list, add_points: list = None, visible: bool = False) -> None:
+    def set_picture(self, background: QImage, points: list, add_points: list = None, visible: bool = False) -> None:
 
         self.scene().clear()
-        self.scene().addPixmap(QPixmap(background))
+        self.scene().addPixmap(QPixmap.fromImage(background))
 
         r = self._radius.value() / 10
         w = r / 4
@@ -493,8 +540,19 @@ class Picture(QGraphicsView):
         if event.buttons() & Qt.RightButton:
             self.prev_pos = event.pos()
 
+        if event.button() == Qt.LeftButton:
+            item = self.itemAt(event.pos())
+            self.moving = isinstance(item, GraphicPoint) and bool(item.flags() & QGraphicsItem.ItemIsMovable)
+
         super().mousePressEvent(event)
 
+    def mouseReleaseEvent(self, event: QMouseEvent) -> None:
+        super().mouseReleaseEvent(event)
+
+        if event.button() == Qt.LeftButton and self.moving:
+            self.moving = False
+            self.edited.emit()
+
     def mouseMoveEvent(self, event: QMouseEvent) -> None:
 
         if event.buttons() & Qt.RightButton:
@@ -514,13 +572,13 @@ class ActionBar(QGroupBox):
         radius = QPushButton()
         radius.setObjectName("radius")
         radius.setCheckable(True)
-        radius.setIcon(QIcon("static/images/radius.png"))
+        radius.setIcon(resources.icon("radius.png"))
         radius.setIconSize(QSize(24, 24))
         radius.setCursor(Qt.PointingHandCursor)
 
         left = QPushButton()
         left.setObjectName("left")
-        left.setIcon(QIcon("static/images/left.png"))
+        left.setIcon(resources.icon("left.png"))
         left.setIconSize(QSize(22, 22))
         left.setCursor(Qt.PointingHandCursor)
         left.clicked.connect(self.previous)
@@ -535,17 +593,20 @@ class ActionBar(QGroupBox):
 
         right = QPushButton()
         right.setObjectName("right")
-        right.setIcon(QIcon("static/images/right.png"))
+        right.setIcon(resources.icon("right.png"))
         right.setIconSize(QSize(22, 22))
         right.setCursor(Qt.PointingHandCursor)
         right.clicked.connect(self.next)
 
         reload = QPushButton()
         reload.setObjectName("reload")
-        reload.setIcon(QIcon("static/images/reload.png"))
+        reload.setIcon(resources.icon("reload.png"))
         reload.setIconSize(QSize(18, 18))
         reload.setCursor(Qt.PointingHandCursor)
 
+        progress = QLabel()
+        progress.setObjectName("progress")
+
         layout.addWidget(radius)
         layout.addSpacing(20)
         layout.addWidget(left)
@@ -553,6 +614,8 @@ class ActionBar(QGroupBox):
         layout.addWidget(right)
         layout.addSpacing(20)
         layout.addWidget(reload)
+        layout.addSpacing(20)
+        layout.addWidget(progress)
 
         self.setLayout(layout)
 
@@ -562,6 +625,7 @@ class ActionBar(QGroupBox):
         self._setUI(amount_pages)
 
         self.amount_pages = amount_pages
+        self.available_pages = amount_pages
         self.current_type = None
         self.current_page = {WallTypes.ENDO: 1, WallTypes.EPI: 1}
 
@@ -591,17 +655,20 @@ class ActionBar(QGroupBox):
         pages.setText(str(self.current_page[type]))
         self.turned.emit((type, self.current_page[type]))
 
+    def set_available_pages(self, amount: int) -> None:
+        self.available_pages = min(max(amount, 1), self.amount_pages)
+
     def set_page(self, text: str) -> None:
-        if 0 < int(text) <= self.amount_pages:
+        if 0 < int(text) <= self.available_pages:
             self.current_page[self.current_type] = int(text)
             self.turned.emit((self.current_type, self.current_page[self.current_type]))
 
     def next(self) -> None:
         pages: EntryLinePostfix = self.findChild(EntryLinePostfix, "pages")
         right: QPushButton = self.findChild(QPushButton, "right")
-        if self.current_page[self.current_type] < self.amount_pages:
+        if self.current_page[self.current_type] < self.available_pages:
             self.current_page[self.current_type] += 1
-        elif self.current_page[self.current_type] == self.amount_pages:
+        else:
             self.current_page[self.current_type] = 1
         pages.setText(str(self.current_page[self.current_type]))
         self.turned.emit((self.current_type, self.current_page[self.current_type]))
@@ -611,18 +678,28 @@ class ActionBar(QGroupBox):
         left: QPushButton = self.findChild(QPushButton, "left")
         if self.current_page[self.current_type] > 1:
             self.current_page[self.current_type] -= 1
-        elif self.current_page[self.current_type] == 1:
-            self.current_page[self.current_type] = self.amount_pages
+        else:
+            self.current_page[self.current_type] = self.available_pages
         pages.setText(str(self.current_page[self.current_type]))
         self.turned.emit((self.current_type, self.current_page[self.current_type]))
 
+    def show_stats(self, stats: dict) -> None:
+        progress: QLabel = self.findChild(QLabel, "progress")
+        if not stats:
+            return progress.clear()
+        done, total, elapsed = stats["done"], stats["total"], stats["elapsed"]
+        fps = done / elapsed if elapsed else 0.0
+        eta = (total - done) / fps if fps else 0.0
+        progress.setText(f"Tracking {done} / {total}   {fps:.1f} frames/s   ETA {eta:.0f} s")
+
     def moveEvent(self, event: QMoveEvent) -> None:
         self.radius_slider_move(event.pos())
         super().moveEvent(event)
 
 
 class Gallery(QWidget):
-    reload = pyqtSignal(dict)
+    reload = pyqtSignal(object)
+    edited = pyqtSignal(str, int)
 
     def _setUI(self, data: dict) -> None:
         self.setObjectName("gallery")
@@ -650,7 +727,8 @@ class Gallery(QWidget):
             walltypes = WallTypes(WallTypes.EPI)
             action_bar.change_type_pages(WallTypes.EPI)
 
-        picture = Picture(data.get("frames")[0])
+        picture = Picture(data.get("frames").image(0))
+        picture.edited.connect(self.contour_edited)
 
         walltypes.turned.connect(action_bar.change_type_pages)
         connect_button = walltypes.findChild(QPushButton, "connect_button")
@@ -677,15 +755,36 @@ class Gallery(QWidget):
         self._setUI(data)
         self.data = data
 
+    def set_tracking(self, tracking: bool) -> None:
+        self.findChild(Menu).setEnabled(not tracking)
+        if not tracking:
+            self.findChild(ActionBar).show_stats({})
+
+    def frame_ready(self, number: int) -> None:
+        action_bar: ActionBar = self.findChild(ActionBar)
+        action_bar.set_available_pages(min(len(contours) for contours in self.data.get("ready_contours").values()))
+        if action_bar.current_page[action_bar.current_type] == number + 1:
+            self.refresh()
+
+    def refresh(self) -> None:
+        action_bar: ActionBar = self.findChild(ActionBar)
+        if self.isVisible() and not self.findChild(Picture).moving:
+            self.page_turning((action_bar.current_type, action_bar.current_page[action_bar.current_type]))
+
+    def contour_edited(self) -> None:
+        action_bar: ActionBar = self.findChild(ActionBar)
+        wall = "endo" if action_bar.current_type == WallTypes.ENDO else "epi"
+        self.edited.emit(wall, action_bar.current_page[action_bar.current_type] - 1)
+
     def get_current_contour(self) -> None:
         action_bar: ActionBar = self.findChild(ActionBar)
         type, page = action_bar.current_type, action_bar.current_page[action_bar.current_type]
-        data = {"frames": self.data.get("frames")[page - 1:], "ready_contours": {}}
+        contours = {}
         if type == WallTypes.ENDO:
-            data["ready_contours"]["endo"] = self.data.get("ready_contours").get("endo")[page - 1]
+            contours["endo"] = self.data.get("ready_contours").get("endo")[page - 1]
         elif type == WallTypes.EPI:
-            data["ready_contours"]["epi"] = self.data.get("ready_contours").get("epi")[page - 1]
-        self.reload.emit(data)
+            contours["epi"] = self.data.get("ready_contours").get("epi")[page - 1]
+        self.reload.emit(TrackingJob(contours, self.data.get("frames"), page - 1))
 
     def page_turning(self, page: tuple) -> None:
         walltype, number = page
@@ -693,7 +792,7 @@ class Gallery(QWidget):
 
         walltypes: WallTypes = self.findChild(WallTypes)
         picture: Picture = self.findChild(Picture)
-        frame = self.data.get("frames")[number]
+        frame = self.data.get("frames").image(number)
         contours = self.data.get("ready_contours")
 
         if walltypes.type == WallTypes.BOTH:
@@ -732,7 +831,7 @@ class Wait(QWidget):
         layout.setContentsMargins(0, 0, 0, 0)
         layout.setSpacing(0)
 
-        movie = QMovie("static/images/wait.gif")
+        movie = QMovie(resources.path("images", "wait.gif"))
         movie.setSpeed(150)
         movie.start()
 
@@ -760,8 +859,7 @@ class Workspace(QStackedWidget):
     def _setUI(self, data: dict) -> None:
         self.setObjectName("workspace")
 
-        with open("static/styles/gallery.css", "r") as style:
-            self.setStyleSheet(style.read())
+        self.setStyleSheet(resources.stylesheet("gallery"))
 
         wait = Wait()
         gallery = Gallery(data)
@@ -775,18 +873,49 @@ class Workspace(QStackedWidget):
     def __init__(self, data: dict = None):
         super().__init__()
 
-        dir = os.path.basename(os.path.dirname(data.get("frames")[0]))
-        self.setWindowTitle(dir)
+        self.setWindowTitle(data.get("title"))
 
         self._setUI(data)
 
-        self.lucas_kanade = LucasKanade(data.get("amount_points"), self)
-        self.lucas_kanade.released.connect(self.init_gallery)
+        self.scheduler = TrackingScheduler(data.get("amount_points"), self)
+        self.scheduler.seeded.connect(self.seeded)
+        self.scheduler.progress.connect(self.stream)
+        self.scheduler.released.connect(self.released)
+        self.scheduler.idle.connect(self.finish)
+        self.scheduler.stats.connect(self.widget(1).findChild(ActionBar).show_stats)
+
+        self.journal = None
+        if data.get("dir") and data.get("title"):
+            self.journal = Journal(Journal.path_for(data.get("dir"), data.get("title")))
+        self.dirty = set()
+        self.unsaved = data.pop("resumed", False)
+        self.autosave = QTimer(self, interval=2000, timeout=self.save_journal)
+        # Without a systole frame from the files it follows the smallest cavity as contours are tracked and edited
+        self.phases = CardiacPhases(len(data.get("frames")))
+        self.detecting = data.get("sys_id") in (None, -1) and get_param("detect_phases") == "1"
+        self.widget(1).edited.connect(self.mark)
+        self.widget(1).findChild(Menu).saved.connect(self.saved)
+
+        frames = data.get("frames")
+        self.initial = TrackingJob(data.get("ready_contours"), frames)
+        self.setCurrentIndex(0)
+        self.segmentation(self.initial)
+
+        # Walls restored from a journal before tracking had finished carry on from their last frame
+        for wall, contours in data.get("ready_contours").items():
+            if isinstance(contours, list) and contours and isinstance(contours[0], list) \
+                    and len(contours) < len(frames):
+                self.scheduler.enqueue(TrackingJob({wall: contours[0]}, frames, resume=len(contours)))
 
-        self.segmentation(data)
         self.setAttribute(Qt.WA_DeleteOnClose)
         self.showMaximized()
 
+    def seeded(self, job: TrackingJob, contours: dict) -> None:
+        if job is self.initial:
+            self.init_gallery(contours)
+        elif job.resume == 1:
+            self.update_gallery(job, contours)
+
     def init_gallery(self, contours: dict) -> None:
         gallery: Gallery = self.widget(1)
 
@@ -812,20 +941,106 @@ class Workspace(QStackedWidget):
             pass
 
         gallery.data["ready_contours"] = contours
-        self.lucas_kanade.released.disconnect()
-        self.lucas_kanade.released.connect(self.update_gallery)
+        for wall, values in contours.items():
+            self.phases.set(wall, values)
+        self.detect_phases()
+        gallery.frame_ready(0)
         self.setCurrentIndex(1)
 
-    def update_gallery(self, contours: dict) -> None:
+        if self.journal is not None:
+            self.journal.start(self.journal_header(), [Journal.frame(wall, n, points)
+                                                       for wall, values in contours.items()
+                                                       for n, points in enumerate(values)])
+            self.autosave.start()
+
+    def update_gallery(self, job: TrackingJob, contours: dict) -> None:
         gallery: Gallery = self.widget(1)
-        action_bar = gallery.findChild(ActionBar)
-        page = action_bar.current_page[action_bar.current_type]
         for wall, values in contours.items():
-            gallery.data["ready_contours"][wall][page - 1:] = values
-        self.setCurrentIndex(1)
+            gallery.data["ready_contours"][wall][job.start:job.start + len(values)] = values
+            for n in range(job.start, job.start + len(values)):
+                self.mark(wall, n)
 
-    def segmentation(self, data: dict) -> None:
-        self.setCurrentIndex(0)
+    def stream(self, job: TrackingJob, frame: dict) -> None:
+        gallery: Gallery = self.widget(1)
+        number = job.start + frame["frame"]
+        for wall, points in frame["contours"].items():
+            contours = gallery.data["ready_contours"][wall]
+            if number < len(contours):
+                contours[number] = points
+            else:
+                contours.append(points)
+            self.mark(wall, number)
+        gallery.frame_ready(number)
+
+    def released(self, job: TrackingJob, data: dict) -> None:
+        gallery: Gallery = self.widget(1)
+        for wall in data.get("smoothed", ()):
+            contours = gallery.data["ready_contours"][wall]
+            for n, points in enumerate(data[wall][1:], start=job.start + 1):
+                contours[n] = points
+                self.mark(wall, n)
+        gallery.refresh()
+
+    def finish(self) -> None:
+        self.widget(1).set_tracking(False)
+
+    def journal_header(self) -> dict:
+        data = self.widget(1).data
         frames = data.get("frames")
-        ready_contours = data.get("ready_contours")
-        self.lucas_kanade.begin(ready_contours, frames)
\ No newline at end of file
+        scale_start, scale_end = data.get("scale_start"), data.get("scale_end")
+        return {
+            "title": data.get("title"),
+            "frames": frames.names(),
+            "step": getattr(frames.indexes, "step", 1),
+            "walls": list(data.get("ready_contours")),
+            "sys_id": data.get("sys_id", -1),
+            "scale_start": None if scale_start is None else (scale_start.x(), scale_start.y()),
+            "scale_end": None if scale_end is None else (scale_end.x(), scale_end.y())
+        }
+
+    def mark(self, wall: str, number: int) -> None:
+        self.dirty.add((wall, number))
+        self.unsaved = True
+
+        contours = self.widget(1).data.get("ready_contours").get(wall, ())
+        if number < len(contours):
+            self.phases.set(wall, [contours[number]], number)
+            self.detect_phases()
+
+    def detect_phases(self) -> None:
+        if not self.detecting:
+            return
+        systole, _ = self.phases.detect()
+        if systole < 0:
+            return
+        # sys_id is the 1-based frame number of the study, not the position among the tracked frames
+        data = self.widget(1).data
+        data["sys_id"] = data.get("frames").indexes[systole] + 1
+
+    def save_journal(self) -> None:
+        if self.journal is None or not self.dirty:
+            return
+        contours = self.widget(1).data.get("ready_contours")
+        self.journal.append([Journal.frame(wall, n, contours[wall][n]) for wall, n in sorted(self.dirty)
+                             if n < len(contours.get(wall, ()))])
+        self.dirty.clear()
+
+    def saved(self) -> None:
+        if self.journal is None:
+            return
+        self.save_journal()
+        self.journal.saved()
+        self.unsaved = False
+
+    def closeEvent(self, event: QCloseEvent) -> None:
+        self.scheduler.cancel()
+        self.scheduler.wait()
+        self.autosave.stop()
+        if self.journal is not None:
+            self.save_journal()
+            self.journal.close(remove=not self.unsaved)
+        super().closeEvent(event)
+
+    def segmentation(self, job: TrackingJob) -> None:
+        self.widget(1).set_tracking(True)
+        self.scheduler.submit(job)
\ No newline at end of file